@@ -1,6 +1,7 @@
 """Analyze face encodings to suggest a matching threshold.
 
-- Loads `models/encodings.json` (must be created by `train_encodings.py`).
+- Loads the encoding store in `models/` (created by `train_encodings.py`; a legacy
+  `models/encodings.json` is migrated automatically).
 - Computes pairwise Euclidean distances between encodings.
 - Separates intra-class (same username) and inter-class distances.
 - Prints summary statistics and suggests a threshold.
@@ -8,26 +9,19 @@
 Usage:
     python analyze_thresholds.py
 """
-import os, json, sys
+import os, sys
 import numpy as np
+import encoding_store
 
 BASE = os.path.dirname(os.path.abspath(__file__))
-ENC_FILE = os.path.join(BASE, 'models', 'encodings.json')
 
-if not os.path.exists(ENC_FILE):
-    print(f"Encodings file not found: {ENC_FILE}\nRun train_encodings.py first.")
+data = encoding_store.load_encodings(mmap=False)
+names = data['names']
+if not names:
+    print('No encodings found. Run train_encodings.py first.')
     sys.exit(1)
 
-with open(ENC_FILE, 'r') as f:
-    data = json.load(f)
-
-names = data.get('names', [])
-encodings = data.get('encodings', [])
-if not encodings:
-    print('No encodings found in file. Run training first.')
-    sys.exit(1)
-
-encs = np.array(encodings)
+encs = data['encodings'].astype(np.float64)
 N = len(encs)
 print(f"Loaded {N} encodings for {len(set(names))} unique users.")
 
@@ -0,0 +1,88 @@
+"""Recall-vs-exact report for the approximate (IVF) gallery index.
+
+- Loads the encoding store in `models/`, or builds a synthetic gallery with
+  `--synthetic USERS` (e.g. 5000 users x 10 images = 50k encodings).
+- Uses perturbed copies of stored encodings as queries.
+- For each nprobe value, compares the IVF index against exact brute force:
+    recall@K   - share of the exact K nearest rows the IVF index also returned
+    decision   - share of queries whose accept/low_confidence/no_match decision
+                 and chosen username match exact search at MATCH_THRESHOLD/KNN_K
+    ms/query   - matching latency, and speedup over exact
+- Reads MATCH_THRESHOLD, KNN_K and CONFIDENCE_THRESHOLD from the environment,
+  exactly like app.py, so run it with the values you deploy.
+
+Usage:
+    python ann_report.py
+    python ann_report.py --synthetic 5000 --per-user 10 --nprobe 1,2,4,8,16,32
+"""
+import os, sys, time, argparse
+import numpy as np
+import encoding_store
+from gallery import Gallery, IVFGallery
+
+MATCH_THRESHOLD = float(os.getenv('MATCH_THRESHOLD','0.60'))
+KNN_K = int(os.getenv('KNN_K','5'))
+CONFIDENCE_THRESHOLD = float(os.getenv('CONFIDENCE_THRESHOLD','0.50'))
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+parser.add_argument('--synthetic', type=int, default=0, help='number of synthetic users (0 = use models/)')
+parser.add_argument('--per-user', type=int, default=10, help='encodings per synthetic user')
+parser.add_argument('--queries', type=int, default=500)
+parser.add_argument('--noise', type=float, default=0.02, help='per-dimension std of query perturbation')
+parser.add_argument('--nlist', type=int, default=0, help='IVF lists (0 = sqrt(N))')
+parser.add_argument('--nprobe', default='1,2,4,8,16,32')
+parser.add_argument('--batch', type=int, default=30, help='faces per matching call (a full classroom frame)')
+args = parser.parse_args()
+
+rng = np.random.default_rng(0)
+if args.synthetic:
+    # centres ~0.8 apart, same-user spread ~0.4: roughly what dlib encodings look like
+    centres = rng.normal(0, 0.05, (args.synthetic, 128)).astype(np.float32)
+    encs = np.repeat(centres, args.per_user, axis=0) + rng.normal(0, 0.025, (args.synthetic * args.per_user, 128)).astype(np.float32)
+    names = [f'user{i:05d}' for i in range(args.synthetic) for _ in range(args.per_user)]
+else:
+    data = encoding_store.load_encodings()
+    names, encs = data['names'], np.asarray(data['encodings'])
+    if not names:
+        print('No encodings found. Run train_encodings.py first or pass --synthetic.')
+        sys.exit(1)
+
+N = len(names)
+picks = rng.integers(0, N, args.queries)
+queries = encs[picks] + rng.normal(0, args.noise, (args.queries, encs.shape[1])).astype(np.float32)
+print(f"Gallery: {N} encodings, {len(set(names))} users; {args.queries} queries, batch {args.batch}")
+print(f"MATCH_THRESHOLD={MATCH_THRESHOLD} KNN_K={KNN_K} CONFIDENCE_THRESHOLD={CONFIDENCE_THRESHOLD}\n")
+
+
+def run(g):
+    """Return (top-K row sets, decisions, seconds) for all queries."""
+    tops, decisions = [], []
+    t0 = time.perf_counter()
+    for s in range(0, len(queries), args.batch):
+        q = queries[s:s + args.batch]
+        decisions += [(m['decision'], m['chosen']) for m in g.match(q, KNN_K, MATCH_THRESHOLD, CONFIDENCE_THRESHOLD)]
+    elapsed = time.perf_counter() - t0
+    for s in range(0, len(queries), args.batch):
+        tops += [set(r.tolist()) for r in g.search(queries[s:s + args.batch], KNN_K)[0]]
+    return tops, decisions, elapsed
+
+
+exact = Gallery(names, encs)
+ex_tops, ex_dec, ex_t = run(exact)
+print(f"{'index':<18}{'recall@K':>10}{'decision':>10}{'ms/query':>10}{'speedup':>9}")
+print(f"{'exact':<18}{1.0:>10.4f}{1.0:>10.4f}{ex_t * 1000 / len(queries):>10.3f}{1.0:>9.2f}")
+
+t0 = time.perf_counter()
+ivf = IVFGallery(names, encs, nlist=args.nlist or None)
+print(f"(IVF build: nlist={ivf.nlist}, {time.perf_counter() - t0:.2f}s)")
+for nprobe in [int(x) for x in args.nprobe.split(',')]:
+    if nprobe > ivf.nlist:
+        continue
+    ivf.nprobe = nprobe
+    tops, dec, t = run(ivf)
+    k = min(KNN_K, N)
+    recall = np.mean([len(a & b) / k for a, b in zip(tops, ex_tops)])
+    agree = np.mean([a == b for a, b in zip(dec, ex_dec)])
+    print(f"{'ivf nprobe=' + str(nprobe):<18}{recall:>10.4f}{agree:>10.4f}{t * 1000 / len(queries):>10.3f}{ex_t / t:>9.2f}")
+
+print('\nGuidance: enable GALLERY_INDEX=ivf only with an IVF_NPROBE whose decision agreement is ~1.0.')
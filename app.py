@@ -1,23 +1,37 @@
-import os, io, json, base64, random
+import os, json, time, base64, random, threading, uuid
 from datetime import datetime, date, timedelta
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, send_from_directory, g
 from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail, Message
 from itsdangerous import URLSafeTimedSerializer
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 from flask_wtf.csrf import CSRFProtect
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.executors.pool import ThreadPoolExecutor as SchedulerThreadPool
 from werkzeug.utils import secure_filename
+from sqlalchemy import func, tuple_, literal
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from werkzeug.security import generate_password_hash, check_password_hash
-from PIL import Image
-import numpy as np
-import face_recognition
+import encoding_store
+import trainer
+import db_setup
+import attendance_summary
+import mail_queue
+import live_events
+from recognition import RecognitionPool, PoolBusy, process_frame, process_crops
+from tracking import FaceTracker
+from match_cache import MatchCache
+from gallery import build_gallery
 
 # ---------------- config ----------------
+# Encoder and recognition workers start from a forkserver, which imports the entry
+# script as __mp_main__: when that is this file (`python app.py`), define everything
+# but do not load encodings, start the scheduler or build encodings in the worker.
+MP_WORKER = __name__ == '__mp_main__'
 BASE = os.path.dirname(os.path.abspath(__file__))
 FACE_DIR = os.path.join(BASE, 'face_data')
 MODEL_DIR = os.path.join(BASE, 'models')
-ENC_FILE = os.path.join(MODEL_DIR, 'encodings.json')
 os.makedirs(FACE_DIR, exist_ok=True)
 os.makedirs(MODEL_DIR, exist_ok=True)
 
@@ -26,15 +40,39 @@ load_dotenv(os.path.join(BASE, '.env'))
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'devsecret')
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + os.path.join(BASE, 'db.sqlite3')
+app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///' + os.path.join(BASE, 'db.sqlite3'))
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Database connections (see db_setup.py). SQLite gets WAL + the pragmas below on connect;
+# raise SQLITE_BUSY_TIMEOUT_MS if many classrooms write at once. Measure with load_test.py.
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE','WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS','NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS','5000'))
+SQLITE_CACHE_SIZE_KB = int(os.getenv('SQLITE_CACHE_SIZE_KB','20000'))
+SQLITE_MMAP_SIZE_MB = int(os.getenv('SQLITE_MMAP_SIZE_MB','256'))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE','10'))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW','20'))
+# Attendance records shown per page on the student dashboard
+STUDENT_RECORDS_PER_PAGE = int(os.getenv('STUDENT_RECORDS_PER_PAGE','20'))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = db_setup.engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'], DB_POOL_SIZE, DB_MAX_OVERFLOW, SQLITE_BUSY_TIMEOUT_MS)
 # Mail
 app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER')
 app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT','587'))
-app.config['MAIL_USE_TLS'] = True
+app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS','1') == '1'
 app.config['MAIL_USERNAME'] = os.getenv('MAIL_USERNAME')
 app.config['MAIL_PASSWORD'] = os.getenv('MAIL_PASSWORD')
 app.config['MAIL_DEFAULT_SENDER'] = os.getenv('MAIL_DEFAULT_SENDER', app.config['MAIL_USERNAME'])
+# Outgoing mail is queued in the outbox table and sent by a background job (see mail_queue.py)
+# every MAIL_QUEUE_INTERVAL_SECS, up to MAIL_QUEUE_BATCH mails per SMTP connection. Failed
+# mails are retried with exponential backoff from MAIL_RETRY_BACKOFF_SECS, MAIL_MAX_ATTEMPTS times.
+# MAIL_DIGEST=1 holds attendance notices until MAIL_DIGEST_HOUR (local time) and sends each
+# student one mail for the day; notices after that hour go out right away.
+MAIL_QUEUE_INTERVAL_SECS = float(os.getenv('MAIL_QUEUE_INTERVAL_SECS','10'))
+MAIL_QUEUE_BATCH = int(os.getenv('MAIL_QUEUE_BATCH','50'))
+MAIL_MAX_ATTEMPTS = int(os.getenv('MAIL_MAX_ATTEMPTS','5'))
+MAIL_RETRY_BACKOFF_SECS = float(os.getenv('MAIL_RETRY_BACKOFF_SECS','30'))
+MAIL_DIGEST = os.getenv('MAIL_DIGEST','0') == '1'
+MAIL_DIGEST_HOUR = int(os.getenv('MAIL_DIGEST_HOUR','18'))
 # Recognition thresholds (tweak for more active recognition)
 # Higher MATCH_THRESHOLD -> allow larger distances (more permissive)
 MATCH_THRESHOLD = float(os.getenv('MATCH_THRESHOLD','0.60'))
@@ -42,10 +80,62 @@ MATCH_THRESHOLD = float(os.getenv('MATCH_THRESHOLD','0.60'))
 KNN_K = int(os.getenv('KNN_K','5'))
 # Lower confidence threshold to be more permissive; fallback logic will still guard
 CONFIDENCE_THRESHOLD = float(os.getenv('CONFIDENCE_THRESHOLD','0.50'))
+# Gallery index: 'exact' (brute force) or 'ivf' (approximate, for very large galleries).
+# IVF_NPROBE trades recall for latency; validate with `python ann_report.py` before enabling.
+GALLERY_INDEX = os.getenv('GALLERY_INDEX','exact')
+IVF_NLIST = int(os.getenv('IVF_NLIST','0'))  # 0 -> sqrt(number of encodings)
+IVF_NPROBE = int(os.getenv('IVF_NPROBE','8'))
+# Encoder processes used when rebuilding encodings (0 -> one per CPU core).
+# Small incremental updates are always encoded in-process.
+TRAIN_WORKERS = int(os.getenv('TRAIN_WORKERS','0'))
+# Face detection/encoding for /api/recognize runs off the eventlet hub (see recognition.py).
+# RECOGNITION_MODE: process | thread | inline; RECOGNITION_WORKERS 0 -> one per CPU core.
+# Frames beyond RECOGNITION_QUEUE_DEPTH (queued + running) are rejected with 503 'busy'.
+RECOGNITION_MODE = os.getenv('RECOGNITION_MODE','process')
+RECOGNITION_WORKERS = int(os.getenv('RECOGNITION_WORKERS','0'))
+RECOGNITION_QUEUE_DEPTH = int(os.getenv('RECOGNITION_QUEUE_DEPTH','8'))
+# Responses carry next_frame_ms, the delay the camera client should wait before its
+# next frame: at least FRAME_INTERVAL_MIN_MS, longer when frames take long or queue
+# up, at most FRAME_INTERVAL_MAX_MS (also the hint sent with a 'busy' rejection).
+FRAME_INTERVAL_MIN_MS = int(os.getenv('FRAME_INTERVAL_MIN_MS','400'))
+FRAME_INTERVAL_MAX_MS = int(os.getenv('FRAME_INTERVAL_MAX_MS','3000'))
+# Run HOG detection on a frame downscaled by DETECTION_SCALE (encodings still use full
+# resolution). DETECTION_UPSAMPLE is face_recognition's number_of_times_to_upsample:
+# raise it to find small faces at the back of a hall. Measure with `python bench_detection.py`.
+DETECTION_SCALE = float(os.getenv('DETECTION_SCALE','1.0'))
+DETECTION_UPSAMPLE = int(os.getenv('DETECTION_UPSAMPLE','1'))
+# CLIENT_FACE_CROPS=1 lets browsers with the FaceDetector API upload padded face crops
+# (at most MAX_FACE_CROPS per frame) instead of whole frames; the server then skips HOG.
+# With it off, crop uploads are rejected ('face_crops_disabled').
+CLIENT_FACE_CROPS = os.getenv('CLIENT_FACE_CROPS','0') == '1'
+MAX_FACE_CROPS = int(os.getenv('MAX_FACE_CROPS','32'))
+# Track faces across a camera stream's frames (see tracking.py): accepted faces are not
+# re-encoded until TRACK_REVERIFY_FRAMES frames or TRACK_REVERIFY_SECS seconds have
+# passed, and the full frame is only scanned every TRACK_FULL_DETECT_EVERY frames.
+TRACKING_ENABLED = os.getenv('TRACKING_ENABLED','1') == '1'
+TRACK_IOU = float(os.getenv('TRACK_IOU','0.3'))
+TRACK_MAX_AGE_SECS = float(os.getenv('TRACK_MAX_AGE_SECS','2.0'))
+TRACK_REVERIFY_FRAMES = int(os.getenv('TRACK_REVERIFY_FRAMES','10'))
+TRACK_REVERIFY_SECS = float(os.getenv('TRACK_REVERIFY_SECS','5.0'))
+TRACK_FULL_DETECT_EVERY = int(os.getenv('TRACK_FULL_DETECT_EVERY','5'))
+# Reuse the match of a recent query encoding within MATCH_CACHE_RADIUS (keep it well
+# below MATCH_THRESHOLD) for up to MATCH_CACHE_TTL seconds. MATCH_CACHE_SIZE 0 disables.
+MATCH_CACHE_SIZE = int(os.getenv('MATCH_CACHE_SIZE','256'))
+MATCH_CACHE_RADIUS = float(os.getenv('MATCH_CACHE_RADIUS','0.04'))
+MATCH_CACHE_TTL = float(os.getenv('MATCH_CACHE_TTL','30'))
+# Live dashboard events are sent to Socket.IO rooms, batched per recognition frame
+# (see live_events.py). A student still in view is reported as "already marked" to
+# a teacher at most once per SOCKET_ALREADY_DEDUPE_SECS.
+SOCKET_ALREADY_DEDUPE_SECS = float(os.getenv('SOCKET_ALREADY_DEDUPE_SECS','300'))
 
 db = SQLAlchemy(app)
+with app.app_context():
+    db_setup.install_pragmas(db.engine, db_setup.sqlite_pragmas(
+        SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS, SQLITE_BUSY_TIMEOUT_MS, SQLITE_CACHE_SIZE_KB, SQLITE_MMAP_SIZE_MB))
 mail = Mail(app)
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+recognition_pool = RecognitionPool(RECOGNITION_MODE, RECOGNITION_WORKERS, RECOGNITION_QUEUE_DEPTH)
+match_cache = MatchCache(MATCH_CACHE_SIZE, MATCH_CACHE_RADIUS, MATCH_CACHE_TTL)
 # CSRF protection for forms. Exempt API/fetch endpoints separately below.
 csrf = CSRFProtect(app)
 
@@ -56,14 +146,19 @@ def inject_csrf_token():
     return dict(csrf_token=generate_csrf)
 
 
+def get_current_user():
+    """The logged-in User (or None), loaded at most once per request and cached on flask.g."""
+    if 'current_user' not in g:
+        uid = session.get('user_id')
+        g.current_user = User.query.get(uid) if uid else None
+    return g.current_user
+
+
 @app.context_processor
 def inject_current_user():
     """Inject current_user (User object or None) into all templates as `current_user`."""
-    uid = session.get('user_id')
-    user = None
     try:
-        if uid:
-            user = User.query.get(uid)
+        user = get_current_user()
     except Exception:
         user = None
     return dict(current_user=user)
@@ -83,10 +178,11 @@ def send_verification_email(user):
     try:
         token = serializer.dumps(user.email, salt='email-verify-salt')
         link = url_for('verify_email', token=token, _external=True)
-        msg = Message(subject='Verify your email address', recipients=[user.email])
-        msg.html = render_template('verify_email_email.html', username=user.username, verify_link=link)
-        mail.send(msg)
-        print(f'✅ Verification email sent to {user.email}')
+        queue_mail(user.email, 'Verify your email address',
+                   render_template('verify_email_email.html', username=user.username, verify_link=link))
+        db.session.commit()
+        kick_mail_worker()
+        print(f'✅ Verification email queued for {user.email}')
         return True
     except Exception as e:
         print(f'❌ Verification email send failed: {e}')
@@ -101,10 +197,11 @@ def send_reset_email(user):
     token = serializer.dumps(user.email, salt='password-reset-salt')
     link = url_for('reset_password', token=token, _external=True)
     try:
-        msg = Message(subject='Password reset request', recipients=[user.email])
-        msg.html = render_template('password_reset_email.html', username=user.username, reset_link=link)
-        mail.send(msg)
-        print(f'✅ Reset email sent to {user.email}')
+        queue_mail(user.email, 'Password reset request',
+                   render_template('password_reset_email.html', username=user.username, reset_link=link))
+        db.session.commit()
+        kick_mail_worker()
+        print(f'✅ Reset email queued for {user.email}')
     except Exception as e:
         # Log but still return the link so local/dev testing can use it
         print(f'❌ Email send failed: {e}')
@@ -124,12 +221,20 @@ class User(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 class Attendance(db.Model):
+    # one row per student, day and subject; existing databases get these via migrate_attendance.py
+    __table_args__ = (
+        db.Index('ux_attendance_user_date_subject', 'user_id', 'date', 'subject', unique=True),
+        db.Index('ix_attendance_date_subject', 'date', 'subject', 'user_id'),
+        db.Index('ix_attendance_date_time', 'date', 'time'),
+        db.Index('ix_attendance_user_subject_status', 'user_id', 'subject', 'status'),
+        db.Index('ix_attendance_subject_date_time', 'subject', 'date', 'time'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     user = db.relationship('User', backref='attendances')
     subject = db.Column(db.String(150))
-    date = db.Column(db.String(20))  # yyyy-mm-dd
-    time = db.Column(db.String(8))
+    date = db.Column(db.String(20))  # yyyy-mm-dd (ISO, so string order is date order)
+    time = db.Column(db.String(8))   # HH:MM:SS
     status = db.Column(db.String(20), default='Present')
 
 class Timetable(db.Model):
@@ -142,9 +247,17 @@ class Timetable(db.Model):
 
 # Audit record for manual confirmations
 class ManualConfirmation(db.Model):
+    # history is browsed newest first, optionally per student or actor (see /api/manual_confirmations)
+    __table_args__ = (
+        db.Index('ix_manual_confirmation_created', 'created_at'),
+        db.Index('ix_manual_confirmation_student_created', 'student_id', 'created_at'),
+        db.Index('ix_manual_confirmation_actor_created', 'actor_id', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     actor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     student_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    actor = db.relationship('User', foreign_keys=[actor_id])
+    student = db.relationship('User', foreign_keys=[student_id])
     subject = db.Column(db.String(150))
     date = db.Column(db.String(20))
     time = db.Column(db.String(8))
@@ -153,91 +266,446 @@ class ManualConfirmation(db.Model):
 
 # Audit log for edits and deletes
 class EditAudit(db.Model):
+    __table_args__ = (
+        db.Index('ix_edit_audit_created', 'created_at'),
+        db.Index('ix_edit_audit_actor_created', 'actor_id', 'created_at'),
+        db.Index('ix_edit_audit_target_created', 'target_type', 'created_at'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     actor_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    actor = db.relationship('User', foreign_keys=[actor_id])
     action = db.Column(db.String(50))  # e.g., 'update', 'delete', 'create'
     target_type = db.Column(db.String(50))  # 'timetable', 'attendance', 'user'
     target_id = db.Column(db.Integer)
     details = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+# Outgoing mail waiting for the mail worker (see mail_queue.py). kind 'attendance' rows
+# carry a JSON payload and are rendered at send time so notices can be coalesced.
+class OutboxMail(db.Model):
+    __tablename__ = 'outbox_mail'
+    __table_args__ = (db.Index('ix_outbox_mail_status_due', 'status', 'send_after'),)
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), default='mail')  # 'mail' | 'attendance'
+    recipient = db.Column(db.String(200), nullable=False)
+    subject = db.Column(db.String(300))
+    html = db.Column(db.Text)
+    payload = db.Column(db.Text)
+    status = db.Column(db.String(10), default='pending')  # 'pending' | 'sent' | 'failed'
+    attempts = db.Column(db.Integer, default=0)
+    send_after = db.Column(db.DateTime, default=datetime.utcnow)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    sent_at = db.Column(db.DateTime)
+
+# Materialized attendance counts, maintained by attendance_summary.apply() in the
+# same transaction as every attendance write (rebuild with rebuild_summaries.py)
+class AttendanceSubjectDay(db.Model):
+    __tablename__ = 'attendance_subject_day'
+    date = db.Column(db.String(20), primary_key=True)
+    subject = db.Column(db.String(150), primary_key=True)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    absent = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AttendanceStudentSubject(db.Model):
+    __tablename__ = 'attendance_student_subject'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    subject = db.Column(db.String(150), primary_key=True)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    absent = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AttendanceDay(db.Model):
+    __tablename__ = 'attendance_day'
+    date = db.Column(db.String(20), primary_key=True)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    absent = db.Column(db.Integer, nullable=False, default=0)
+
+
+def add_audit(actor, action, target_type, target_id, details, what):
+    """Stage an EditAudit row in the current transaction.
+
+    The caller commits it together with the change it records (one commit, one
+    fsync on SQLite). A failure to build the row is logged and never blocks the change.
+    """
+    try:
+        db.session.add(EditAudit(actor_id=actor.id if actor else None, action=action, target_type=target_type,
+                                 target_id=target_id, details=details))
+    except Exception:
+        app.logger.exception('Audit failed for %s', what)
+
 # ---------------- encodings helpers ----------------
 def load_encodings():
-    if not os.path.exists(ENC_FILE):
-        return {"names": [], "encodings": []}
-    with open(ENC_FILE,'r') as f:
-        data = json.load(f)
-    encs = [np.array(e) for e in data.get('encodings',[])]
-    return {"names": data.get('names',[]), "encodings": encs}
+    """Load the binary encoding store (migrating models/encodings.json on first use).
+
+    The returned dict also carries a prebuilt `gallery` used by /api/recognize.
+    """
+    enc = encoding_store.load_encodings(MODEL_DIR)
+    opts = {}
+    if GALLERY_INDEX == 'ivf':
+        opts = {'nlist': IVF_NLIST or None, 'nprobe': IVF_NPROBE}
+    enc['gallery'] = build_gallery(enc['names'], enc['encodings'], GALLERY_INDEX, **opts)
+    return enc
 
 
-def build_user_enc_map(enc_obj=None):
-    """Return a dict mapping username -> list of numpy encodings.
+def match_faces(gallery, face_encs):
+    """Match a batch of query encodings using the configured KNN/threshold settings.
 
-    If enc_obj is None, uses the global ENC.
+    Results for encodings close to a recently matched one come from match_cache.
     """
-    if enc_obj is None:
-        enc_obj = globals().get('ENC', None)
-    if not enc_obj or not enc_obj.get('encodings'):
-        return {}
-    m = {}
-    names = enc_obj.get('names', [])
-    encs = enc_obj.get('encodings', [])
-    for n, e in zip(names, encs):
-        m.setdefault(n, []).append(np.array(e))
-    # convert lists to numpy arrays for faster distance computation
-    for k in list(m.keys()):
-        m[k] = np.vstack(m[k]) if len(m[k]) > 0 else np.array([])
-    return m
+    return match_cache.match(gallery, face_encs,
+                             lambda q: gallery.match(q, KNN_K, MATCH_THRESHOLD, CONFIDENCE_THRESHOLD))
 
 def save_encodings(names, encodings):
-    data = {"names": names, "encodings":[e.tolist() for e in encodings]}
-    with open(ENC_FILE,'w') as f:
-        json.dump(data,f)
-
-def build_encodings_from_images():
-    names=[]; encs=[]
-    for username in os.listdir(FACE_DIR):
-        folder = os.path.join(FACE_DIR, username)
-        if not os.path.isdir(folder): continue
-        for fname in os.listdir(folder):
-            if fname.lower().endswith(('.jpg','.jpeg','.png')):
-                path = os.path.join(folder,fname)
-                try:
-                    img = face_recognition.load_image_file(path)
-                    d = face_recognition.face_encodings(img)
-                    if d:
-                        encs.append(d[0]); names.append(username)
-                except Exception as e:
-                    app.logger.warning('skip %s: %s', path, e)
-    save_encodings(names, encs)
-    return names, encs
+    encoding_store.save_encodings(names, encodings, MODEL_DIR)
 
-# pre-load encodings
-ENC = load_encodings()
+def build_encodings_from_images(progress=None):
+    """Bring the encoding store in line with face_data/, encoding only new or
+    changed images (see trainer.py). Returns the trainer's stats dict."""
+    encode = lambda paths: trainer.parallel_encode(paths, workers=TRAIN_WORKERS or None, progress=progress, logger=app.logger)
+    stats = trainer.update_encodings(FACE_DIR, MODEL_DIR, encode=encode, logger=app.logger)
+    app.logger.info('encodings updated: %s', stats)
+    return stats
 
-# ---------------- email helper ----------------
-def send_attendance_email_to_user(user:User, att_date:str, subject_name:str):
-    if not user.email: return False
+
+def refresh_encodings(progress=None):
+    """Update the store and swap the in-memory ENC.
+
+    The new gallery is fully built before the single assignment to ENC, so
+    concurrent recognition requests see either the old or the new set.
+    """
+    global ENC
+    stats = build_encodings_from_images(progress)
+    if stats['changed']:
+        ENC = load_encodings()
+        # cached identities may refer to removed or re-enrolled users
+        with _trackers_lock:
+            TRACKERS.clear()
+        match_cache.clear()
+    return stats
+
+# pre-load encodings (a worker never matches, so it keeps an empty gallery)
+ENC = {'names': [], 'encodings': [], 'gallery': build_gallery([], [])} if MP_WORKER else load_encodings()
+
+# ---------------- face tracking ----------------
+# One FaceTracker per camera stream, keyed by (session user, stream id, subject).
+# In-memory like EMAIL_OTP_STORE; trackers idle for TRACKER_IDLE_SECS are dropped.
+# Rebuilds clear it from the scheduler thread, so every access holds _trackers_lock.
+TRACKERS = {}
+TRACKER_IDLE_SECS = 60
+_trackers_lock = threading.Lock()
+
+
+def get_tracker(stream_id, subject):
+    now = time.time()
+    key = (session.get('user_id'), stream_id, subject)
+    with _trackers_lock:
+        for k in [k for k, t in TRACKERS.items() if now - t.last_used > TRACKER_IDLE_SECS]:
+            del TRACKERS[k]
+        tracker = TRACKERS.get(key)
+        if tracker is None:
+            tracker = TRACKERS[key] = FaceTracker(TRACK_IOU, TRACK_MAX_AGE_SECS, TRACK_REVERIFY_FRAMES,
+                                                  TRACK_REVERIFY_SECS, TRACK_FULL_DETECT_EVERY)
+    return tracker
+
+
+def drop_tracker(key):
+    with _trackers_lock:
+        TRACKERS.pop(key, None)
+
+# ---------------- live events (Socket.IO) ----------------
+# Connections join their own rooms on connect (see live_events.py). Anonymous
+# connections are refused.
+already_filter = live_events.AlreadyFilter(SOCKET_ALREADY_DEDUPE_SECS)
+
+
+def emit_frame_events(actor_id, subject, day, marked, already):
+    """One 'attendance_frame' for a frame's marks / already-marked students, plus each marked student's own notice.
+
+    `marked` is a list of (user_id, username, time); `already` a list of usernames.
+    """
+    # a student just marked here is not reported as "already marked" on the next frames either
+    already_filter.fresh([(actor_id, subject, day, name) for _, name, _ in marked])
+    already = [k[-1] for k in already_filter.fresh([(actor_id, subject, day, name) for name in already])]
+    payload = live_events.frame_event(subject, day, [{'username': name, 'time': t} for _, name, t in marked], already)
+    if payload is None:
+        return
     try:
-        msg = Message(subject=f'Attendance marked: {att_date}',
-                      recipients=[user.email])
-        msg.html = render_template('email_template.html',
-                                   username=user.username,
-                                   date=att_date,
-                                   subject=subject_name,
-                                   organization='Your Institute')
-        mail.send(msg)
-        return True
+        socketio.emit('attendance_frame', payload, to=live_events.frame_rooms(actor_id))
+        for user_id, name, t in marked:
+            socketio.emit('attendance_marked', {'username': name, 'subject': subject, 'date': day, 'time': t},
+                          to=f'student:{user_id}')
+    except Exception:
+        app.logger.exception('Socket emit failed')
+
+
+@socketio.on('connect')
+def socket_connect(auth=None):
+    uid = session.get('user_id')
+    user = User.query.get(uid) if uid else None
+    if not user:
+        return False
+    for room in live_events.user_rooms(user):
+        join_room(room)
+
+# ---------------- marked-today cache ----------------
+# Steady-state recognition frames keep seeing students who are already marked.
+# MARKED_TODAY holds the user ids marked Present per (date, subject), loaded from
+# the DB once per key and kept in step by every write path in this app (recognize,
+# confirm_mark, admin_mark, attendance update/delete, user delete). Writes made
+# outside this process (scripts) are not seen until the key is reloaded.
+# The username -> user id map lives in ENC['user_ids'], so it is rebuilt with ENC;
+# users registered since are added on their first miss (see user_id_for).
+MARKED_TODAY = {}
+
+
+def marked_today(day, subject):
+    """Set of user ids already marked Present for (day, subject); loads it on first use."""
+    key = (day, subject)
+    ids = MARKED_TODAY.get(key)
+    if ids is None:
+        # only today's classes stay hot; drop older days when a new key loads
+        for k in [k for k in MARKED_TODAY if k[0] != day]:
+            del MARKED_TODAY[k]
+        rows = db.session.query(Attendance.user_id).filter_by(date=day, subject=subject, status='Present').all()
+        ids = MARKED_TODAY[key] = {r[0] for r in rows}
+    return ids
+
+
+def note_marked(user_id, day, subject):
+    ids = MARKED_TODAY.get((day, subject))
+    if ids is not None:
+        ids.add(user_id)
+
+
+def forget_marked(day, subject):
+    # reloaded from the DB on next use
+    MARKED_TODAY.pop((day, subject), None)
+
+
+def upgrade_to_present(user_id, day, subject, time_):
+    """Turn the student's non-Present row for (day, subject) into Present (not committed).
+
+    The unique index allows one row per student, day and subject, so a student an
+    admin set Absent can only be marked present this way. Returns the row, or None
+    if it is already Present or gone.
+    """
+    att = Attendance.query.filter_by(user_id=user_id, date=day, subject=subject).first()
+    if att is None or att.status == 'Present':
+        return None
+    old_status = att.status
+    # conditional, so two requests cannot both count the same upgrade
+    if not Attendance.query.filter_by(id=att.id, status=old_status).update({'status': 'Present', 'time': time_}):
+        return None
+    attendance_summary.apply(db.session, [(user_id, day, subject, old_status, -1), (user_id, day, subject, 'Present', 1)])
+    return att
+
+
+def insert_attendance(rows, stage=None):
+    """Insert attendance rows (dicts of column values) in one transaction.
+
+    The unique (user_id, date, subject) index rejects a student already recorded,
+    e.g. by a concurrent request. If that happens the batch is retried row by
+    row so the others still go in, and a Present row replacing one with another
+    status (see upgrade_to_present) updates it instead. Returns a list of
+    booleans: recorded or not.
+    `stage(row)`, if given, adds whatever goes with a row (its notification mail)
+    to the same transaction, so it is committed or rolled back with the row.
+    """
+    if not rows:
+        return []
+
+    def stage_row(r):
+        db.session.add(Attendance(**r))
+        if stage:
+            stage(r)
+
+    # flush first so a duplicate fails on the insert, before the summary upsert runs
+    try:
+        for r in rows:
+            stage_row(r)
+        db.session.flush()
+        attendance_summary.apply(db.session, [(r['user_id'], r['date'], r['subject'], r['status'], 1) for r in rows])
+        db.session.commit()
+        return [True] * len(rows)
+    except IntegrityError:
+        db.session.rollback()
+    out = []
+    for r in rows:
+        try:
+            stage_row(r)
+            attendance_summary.apply(db.session, [(r['user_id'], r['date'], r['subject'], r['status'], 1)])
+            db.session.commit()
+            out.append(True)
+        except IntegrityError:
+            db.session.rollback()
+            if r['status'] == 'Present' and upgrade_to_present(r['user_id'], r['date'], r['subject'], r['time']):
+                if stage:
+                    stage(r)
+                db.session.commit()
+                out.append(True)
+                continue
+            db.session.rollback()
+            note_marked(r['user_id'], r['date'], r['subject'])
+            out.append(False)
+    return out
+
+
+def user_id_for(username):
+    """User id for a recognized username (None if no user record), without a query per frame.
+
+    A user registered after the map was built is looked up on the miss and added.
+    """
+    enc = ENC
+    ids = enc.get('user_ids')
+    if ids is None:
+        ids = enc['user_ids'] = dict(db.session.query(User.username, User.id).all())
+    user_id = ids.get(username)
+    if user_id is None:
+        user_id = db.session.query(User.id).filter_by(username=username).scalar()
+        if user_id is not None:
+            ids[username] = user_id
+    return user_id
+
+# ---------------- background training jobs ----------------
+# Rebuilds run on the scheduler's single worker thread, one at a time, so HTTP
+# requests only save images and enqueue. Enrollments that arrive while a job is
+# still queued join that job instead of adding another rebuild.
+# In-memory like EMAIL_OTP_STORE: job history is lost on restart.
+TRAIN_JOBS = {}
+TRAIN_JOBS_KEEP = 100
+_train_lock = threading.Lock()
+_queued_train_job = None
+
+scheduler = BackgroundScheduler(executors={'default': SchedulerThreadPool(1), 'mail': SchedulerThreadPool(1)},
+                                job_defaults={'misfire_grace_time': None})
+
+
+def submit_train_job(reason):
+    """Queue an encodings rebuild (coalescing with a not-yet-started one); returns the job dict."""
+    global _queued_train_job
+    with _train_lock:
+        job = TRAIN_JOBS.get(_queued_train_job)
+        if job and job['status'] == 'queued':
+            job['reasons'].append(reason)
+            return job
+        job = {'id': uuid.uuid4().hex, 'status': 'queued', 'reasons': [reason],
+               'progress': {'done': 0, 'total': 0},
+               'submitted_at': datetime.utcnow().isoformat(), 'started_at': None, 'finished_at': None,
+               'stats': None, 'error': None}
+        TRAIN_JOBS[job['id']] = job
+        _queued_train_job = job['id']
+        for old_id in list(TRAIN_JOBS)[:-TRAIN_JOBS_KEEP]:
+            if TRAIN_JOBS[old_id]['status'] in ('done', 'failed'):
+                del TRAIN_JOBS[old_id]
+    scheduler.add_job(_run_train_job, args=[job['id']], id='train-' + job['id'])
+    return job
+
+
+def _run_train_job(job_id):
+    global _queued_train_job
+    with _train_lock:
+        job = TRAIN_JOBS[job_id]
+        job['status'] = 'running'
+        job['started_at'] = datetime.utcnow().isoformat()
+        if _queued_train_job == job_id:
+            _queued_train_job = None
+
+    def progress(done, total, elapsed):
+        job['progress'] = {'done': done, 'total': total, 'images_per_sec': round(done / elapsed, 1) if elapsed else None}
+
+    try:
+        job['stats'] = refresh_encodings(progress)
+        job['status'] = 'done'
     except Exception as e:
-        app.logger.exception('Mail send failed: %s', e)
+        app.logger.exception('training job %s failed', job_id)
+        job['error'] = str(e)
+        job['status'] = 'failed'
+    job['finished_at'] = datetime.utcnow().isoformat()
+
+
+def train_job_view(job):
+    return {k: job[k] for k in ('id', 'status', 'progress', 'submitted_at', 'started_at', 'finished_at', 'stats', 'error')}
+
+
+if not MP_WORKER:
+    scheduler.start()
+
+# ---------------- email helper ----------------
+# Mail is staged in the outbox with the change that triggers it (the caller commits)
+# and sent by the 'mail-outbox' job on its own scheduler thread, so requests never
+# wait on SMTP. kick_mail_worker() runs the job now instead of at its next interval.
+def queue_mail(recipient, subject, html):
+    db.session.add(OutboxMail(kind='mail', recipient=recipient, subject=subject, html=html))
+
+
+def queue_attendance_email(user, att_date, subject_name):
+    if not user or not user.email:
         return False
+    send_after = datetime.utcnow()
+    if MAIL_DIGEST:
+        digest_at = datetime.combine(date.today(), datetime.min.time()) + timedelta(hours=MAIL_DIGEST_HOUR)
+        send_after += max(digest_at - datetime.now(), timedelta(0))
+    db.session.add(OutboxMail(kind='attendance', recipient=user.email, send_after=send_after,
+                              payload=json.dumps({'username': user.username, 'date': att_date, 'subject': subject_name})))
+    return True
+
+
+def build_outbox_message(rows):
+    """Message for a group of outbox rows: one plain mail, or one or more attendance notices."""
+    first = rows[0]
+    if first.kind != 'attendance':
+        msg = Message(subject=first.subject, recipients=[first.recipient])
+        msg.html = first.html
+        return msg
+    marks = [json.loads(r.payload) for r in rows]
+    if len(marks) == 1:
+        msg = Message(subject=f"Attendance marked: {marks[0]['date']}", recipients=[first.recipient])
+        msg.html = render_template('email_template.html', username=marks[0]['username'], date=marks[0]['date'],
+                                   subject=marks[0]['subject'], organization='Your Institute')
+    else:
+        msg = Message(subject=f'Attendance marked: {len(marks)} classes', recipients=[first.recipient])
+        msg.html = render_template('attendance_digest_email.html', username=marks[0]['username'], marks=marks,
+                                   organization='Your Institute')
+    return msg
+
+
+def drain_outbox():
+    with app.app_context():
+        if not app.config.get('MAIL_SERVER'):
+            return  # keep mail queued until a server is configured
+        try:
+            stats = mail_queue.drain(db.session, OutboxMail, mail.connect, build_outbox_message,
+                                     MAIL_QUEUE_BATCH, MAIL_MAX_ATTEMPTS, MAIL_RETRY_BACKOFF_SECS)
+            if stats['retry'] or stats['failed']:
+                app.logger.warning('Mail queue: %s', stats)
+        except Exception:
+            db.session.rollback()
+            app.logger.exception('Mail queue drain failed')
+        finally:
+            db.session.remove()
+
+
+def kick_mail_worker():
+    try:
+        scheduler.modify_job('mail-outbox', next_run_time=datetime.now())
+    except Exception:
+        app.logger.exception('Mail worker kick failed')
+
+
+scheduler.add_job(drain_outbox, 'interval', seconds=MAIL_QUEUE_INTERVAL_SECS, id='mail-outbox',
+                  executor='mail', max_instances=1, coalesce=True)
+
+def recent_attendance(limit=200):
+    """Latest attendance rows for the admin dashboard, with their users loaded in the same query."""
+    return Attendance.query.options(joinedload(Attendance.user)).order_by(Attendance.date.desc()).limit(limit).all()
 
 # ---------------- views ----------------
 @app.route('/')
 def index():
     if 'user_id' in session:
-        u = User.query.get(session['user_id'])
+        u = get_current_user()
         if u.role=='admin': return redirect(url_for('admin_dashboard'))
         if u.role=='teacher': return redirect(url_for('teacher_take_attendance'))
         return redirect(url_for('student_dashboard'))
@@ -329,11 +797,10 @@ def register():
                         EMAIL_OTP_STORE[user.username] = {'otp': otp, 'sent_at': datetime.utcnow()}
                     except Exception:
                         pass
+                    # Send OTP email (queued with the OTP itself)
+                    queue_mail(email, 'Your Email Verification OTP', render_template('otp_email.html', username=username, otp=otp))
                     db.session.commit()
-                    # Send OTP email
-                    msg = Message(subject='Your Email Verification OTP', recipients=[email])
-                    msg.html = render_template('otp_email.html', username=username, otp=otp)
-                    mail.send(msg)
+                    kick_mail_worker()
                     message = f'✅ Account created! An OTP has been sent to {email}. Enter it to verify your email.'
                 except Exception as e:
                     message = f'Account created but OTP sending failed. Contact admin. Error: {str(e)}'
@@ -427,11 +894,10 @@ def verify_email():
             try:
                 code = str(random.randint(100000, 999999))
                 user.email_otp = code
+                queue_mail(email, 'Your Email Verification OTP', render_template('otp_email.html', username=user.username, otp=code))
                 db.session.commit()
+                kick_mail_worker()
                 EMAIL_OTP_STORE[user.username] = {'otp': code, 'sent_at': datetime.utcnow()}
-                msg = Message(subject='Your Email Verification OTP', recipients=[email])
-                msg.html = render_template('otp_email.html', username=user.username, otp=code)
-                mail.send(msg)
                 return render_template('verify_email_confirm.html', message=f'OTP sent to {email}', username_to_verify=user.username)
             except Exception as e:
                 app.logger.exception('Failed to send verification OTP: %s', e)
@@ -525,8 +991,7 @@ def reset_password(token):
 # Test email route (admin only)
 @app.route('/admin/test_email/<username>')
 def test_email(username):
-    uid = session.get('user_id')
-    admin = User.query.get(uid)
+    admin = get_current_user()
     if not admin or admin.role != 'admin':
         return jsonify({'ok': False, 'error': 'Admin only'})
     
@@ -536,16 +1001,24 @@ def test_email(username):
     
     success = send_reset_email(user)
     if success:
-        return jsonify({'ok': True, 'message': f'Test email sent to {user.email}'})
+        return jsonify({'ok': True, 'message': f'Test email queued for {user.email}'})
     else:
         return jsonify({'ok': False, 'error': 'Email send failed. Check terminal logs.'})
 
 
+# API mail queue: outbox rows per status (admin)
+@app.route('/api/mail/stats')
+def api_mail_stats():
+    u = get_current_user()
+    if not u or u.role != 'admin':
+        return jsonify({'ok': False, 'error': 'Unauthorized'}), 403
+    return jsonify({'ok': True, 'outbox': mail_queue.counts(db.session, OutboxMail)})
+
+
 # Admin reset user password
 @app.route('/admin/reset_user_password/<int:user_id>', methods=['POST'])
 def admin_reset_password(user_id):
-    uid = session.get('user_id')
-    admin = User.query.get(uid)
+    admin = get_current_user()
     if not admin or admin.role != 'admin':
         return jsonify({'ok': False, 'error': 'Unauthorized'})
     
@@ -572,21 +1045,25 @@ def admin_reset_password(user_id):
 def admin_dashboard():
     uid = session.get('user_id')
     if not uid: return redirect(url_for('login'))
-    u = User.query.get(uid)
+    u = get_current_user()
     if not u or u.role!='admin': return redirect(url_for('login'))
     # show students and teachers separately
     students = User.query.filter_by(role='student').order_by(User.username).all()
     teachers = User.query.filter_by(role='teacher').order_by(User.username).all()
-    attendance = Attendance.query.order_by(Attendance.date.desc()).limit(200).all()
+    attendance = recent_attendance()
     timetable = Timetable.query.order_by(Timetable.day, Timetable.start).all()
     today = date.today().isoformat()
-    return render_template('admin_dashboard.html', students=students, teachers=teachers, attendance=attendance, timetable=timetable, today=today)
+    # counts from the summary tables rather than the raw attendance rows
+    total_records = db.session.query(func.sum(AttendanceDay.present + AttendanceDay.absent)).scalar() or 0
+    today_summary = AttendanceDay.query.get(today)
+    present_today = today_summary.present if today_summary else 0
+    return render_template('admin_dashboard.html', students=students, teachers=teachers, attendance=attendance, timetable=timetable, today=today,
+                           total_records=total_records, present_today=present_today)
 
 # Add timetable entry
 @app.route('/admin/timetable/add', methods=['POST'])
 def admin_add_timetable():
-    uid = session.get('user_id')
-    u = User.query.get(uid)
+    u = get_current_user()
     if not u or u.role not in ('admin','teacher'):
         return redirect(url_for('login'))
     day = request.form['day']
@@ -595,22 +1072,16 @@ def admin_add_timetable():
     subj = request.form['subject']
     t = Timetable(day=day, start=start, end=end, subject=subj)
     db.session.add(t)
+    db.session.flush()  # assigns t.id for the audit row
+    add_audit(u, 'create', 'timetable', t.id, f'{t.day} {t.start}-{t.end} {t.subject}', 'timetable create')
     db.session.commit()
-    # audit
-    try:
-        ea = EditAudit(actor_id=u.id if u else None, action='create', target_type='timetable', target_id=t.id, details=f'{t.day} {t.start}-{t.end} {t.subject}')
-        db.session.add(ea)
-        db.session.commit()
-    except Exception:
-        app.logger.exception('Audit failed for timetable create')
     return redirect(url_for('admin_dashboard'))
 
 
 # Update timetable entry
 @app.route('/admin/timetable/update/<int:tid>', methods=['POST'])
 def admin_update_timetable(tid):
-    uid = session.get('user_id')
-    u = User.query.get(uid)
+    u = get_current_user()
     if not u or u.role not in ('admin','teacher'):
         return jsonify({'ok': False, 'error': 'Unauthorized'})
     t = Timetable.query.get(tid)
@@ -621,42 +1092,29 @@ def admin_update_timetable(tid):
     t.start = data.get('start', t.start)
     t.end = data.get('end', t.end)
     t.subject = data.get('subject', t.subject)
+    add_audit(u, 'update', 'timetable', t.id, json.dumps({'day': t.day, 'start': t.start, 'end': t.end, 'subject': t.subject}), 'timetable update')
     db.session.commit()
-    # audit
-    try:
-        ea = EditAudit(actor_id=u.id if u else None, action='update', target_type='timetable', target_id=t.id, details=json.dumps({'day': t.day, 'start': t.start, 'end': t.end, 'subject': t.subject}))
-        db.session.add(ea)
-        db.session.commit()
-    except Exception:
-        app.logger.exception('Audit failed for timetable update')
     return jsonify({'ok': True, 'message': 'Timetable updated'})
 
 
 # Delete timetable entry
 @app.route('/admin/timetable/delete/<int:tid>', methods=['POST'])
 def admin_delete_timetable(tid):
-    uid = session.get('user_id')
-    u = User.query.get(uid)
+    u = get_current_user()
     if not u or u.role not in ('admin','teacher'):
         return jsonify({'ok': False, 'error': 'Unauthorized'})
     t = Timetable.query.get(tid)
     if not t:
         return jsonify({'ok': False, 'error': 'Not found'})
     db.session.delete(t)
+    add_audit(u, 'delete', 'timetable', tid, f'deleted timetable {tid}', 'timetable delete')
     db.session.commit()
-    try:
-        ea = EditAudit(actor_id=u.id if u else None, action='delete', target_type='timetable', target_id=tid, details=f'deleted timetable {tid}')
-        db.session.add(ea)
-        db.session.commit()
-    except Exception:
-        app.logger.exception('Audit failed for timetable delete')
     return jsonify({'ok': True, 'message': 'Timetable entry deleted'})
 
 # Upload multiple images for a student (admin)
 @app.route('/admin/upload_images', methods=['POST'])
 def admin_upload_images():
-    uid = session.get('user_id')
-    u = User.query.get(uid)
+    u = get_current_user()
     if not u or u.role != 'admin':
         return redirect(url_for('login'))
     username = request.form['username']
@@ -665,7 +1123,7 @@ def admin_upload_images():
     if not target_user:
         students = User.query.filter_by(role='student').all()
         teachers = User.query.filter_by(role='teacher').all()
-        attendance = Attendance.query.order_by(Attendance.date.desc()).limit(200).all()
+        attendance = recent_attendance()
         timetable = Timetable.query.order_by(Timetable.day, Timetable.start).all()
         return render_template('admin_dashboard.html', students=students, teachers=teachers, attendance=attendance, timetable=timetable, error=f'User "{username}" not found. Upload aborted.')
     files = request.files.getlist('images')
@@ -674,17 +1132,14 @@ def admin_upload_images():
     for f in files:
         fname = secure_filename(f.filename)
         f.save(os.path.join(folder, fname))
-    # rebuild encodings
-    build_encodings_from_images()
-    global ENC
-    ENC = load_encodings()
+    # rebuild encodings in the background
+    submit_train_job(f'upload:{username}')
     return redirect(url_for('admin_dashboard'))
 
 # Admin manual mark attendance
 @app.route('/admin/mark', methods=['POST'])
 def admin_mark():
-    uid = session.get('user_id')
-    u = User.query.get(uid)
+    u = get_current_user()
     if not u or u.role != 'admin':
         return redirect(url_for('login'))
     username = request.form['username']
@@ -695,29 +1150,29 @@ def admin_mark():
         selected_date = datetime.strptime(dt, '%Y-%m-%d').date()
         if selected_date > date.today():
             students = User.query.filter_by(role='student').all()
-            attendance = Attendance.query.order_by(Attendance.date.desc()).limit(200).all()
+            attendance = recent_attendance()
             timetable = Timetable.query.order_by(Timetable.day, Timetable.start).all()
             return render_template('admin_dashboard.html', students=students, attendance=attendance, timetable=timetable, error='❌ Cannot mark attendance for future dates. Only today and past dates are allowed.')
     except ValueError:
         # Invalid date format
         students = User.query.filter_by(role='student').all()
-        attendance = Attendance.query.order_by(Attendance.date.desc()).limit(200).all()
+        attendance = recent_attendance()
         timetable = Timetable.query.order_by(Timetable.day, Timetable.start).all()
         return render_template('admin_dashboard.html', students=students, attendance=attendance, timetable=timetable, error='❌ Invalid date format. Please use YYYY-MM-DD.')
 
+    dt = selected_date.isoformat()
     user = User.query.filter_by(username=username).first()
     if user:
-        att = Attendance(user_id=user.id, subject=subj, date=dt, time=datetime.now().strftime('%H:%M:%S'), status='Present')
-        db.session.add(att)
-        db.session.commit()
+        # an existing row for that day and subject is left as is, unless it is not Present
+        insert_attendance([{'user_id': user.id, 'subject': subj, 'date': dt, 'time': datetime.now().strftime('%H:%M:%S'), 'status': 'Present'}])
+        note_marked(user.id, dt, subj)
     return redirect(url_for('admin_dashboard'))
 
 
 # Update attendance record (change subject/date/time/status)
 @app.route('/admin/attendance/update/<int:att_id>', methods=['POST'])
 def admin_update_attendance(att_id):
-    uid = session.get('user_id')
-    u = User.query.get(uid)
+    u = get_current_user()
     # allow both admin and teacher roles to edit attendance
     if not u or u.role not in ('admin', 'teacher'):
         return jsonify({'ok': False, 'error': 'Unauthorized'})
@@ -725,25 +1180,36 @@ def admin_update_attendance(att_id):
     if not att:
         return jsonify({'ok': False, 'error': 'Not found'})
     data = request.json or {}
+    # keep date/time in canonical ISO form so string order stays chronological
+    try:
+        new_date = datetime.strptime(data['date'], '%Y-%m-%d').date().isoformat() if data.get('date') else att.date
+        new_time = att.time
+        if data.get('time'):
+            fmt = '%H:%M:%S' if data['time'].count(':') == 2 else '%H:%M'
+            new_time = datetime.strptime(data['time'], fmt).strftime('%H:%M:%S')
+    except ValueError:
+        return jsonify({'ok': False, 'error': 'Invalid date or time'})
+    forget_marked(att.date, att.subject)
+    old_row = attendance_summary.row_delta(att, -1)
     att.subject = data.get('subject', att.subject)
-    att.date = data.get('date', att.date)
-    att.time = data.get('time', att.time)
+    att.date = new_date
+    att.time = new_time
     att.status = data.get('status', att.status)
-    db.session.commit()
+    attendance_summary.apply(db.session, [old_row, attendance_summary.row_delta(att, 1)])
+    add_audit(u, 'update', 'attendance', att.id, json.dumps({'subject': att.subject, 'date': att.date, 'time': att.time, 'status': att.status}), 'attendance update')
     try:
-        ea = EditAudit(actor_id=u.id if u else None, action='update', target_type='attendance', target_id=att.id, details=json.dumps({'subject': att.subject, 'date': att.date, 'time': att.time, 'status': att.status}))
-        db.session.add(ea)
         db.session.commit()
-    except Exception:
-        app.logger.exception('Audit failed for attendance update')
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify({'ok': False, 'error': 'Student already has a record for that subject and date'})
+    forget_marked(att.date, att.subject)
     return jsonify({'ok': True, 'message': 'Attendance updated'})
 
 
 # Delete attendance record
 @app.route('/admin/attendance/delete/<int:att_id>', methods=['POST'])
 def admin_delete_attendance(att_id):
-    uid = session.get('user_id')
-    u = User.query.get(uid)
+    u = get_current_user()
     # allow both admin and teacher roles to delete attendance
     if not u or u.role not in ('admin', 'teacher'):
         return jsonify({'ok': False, 'error': 'Unauthorized'})
@@ -751,20 +1217,16 @@ def admin_delete_attendance(att_id):
     if not att:
         return jsonify({'ok': False, 'error': 'Not found'})
     db.session.delete(att)
+    attendance_summary.apply(db.session, [attendance_summary.row_delta(att, -1)])
+    add_audit(u, 'delete', 'attendance', att_id, f'deleted attendance {att_id}', 'attendance delete')
     db.session.commit()
-    try:
-        ea = EditAudit(actor_id=u.id if u else None, action='delete', target_type='attendance', target_id=att_id, details=f'deleted attendance {att_id}')
-        db.session.add(ea)
-        db.session.commit()
-    except Exception:
-        app.logger.exception('Audit failed for attendance delete')
+    forget_marked(att.date, att.subject)
     return jsonify({'ok': True, 'message': 'Attendance deleted'})
 
 # Teacher - take attendance page
 @app.route('/teacher/take')
 def teacher_take_attendance():
-    uid = session.get('user_id')
-    u = User.query.get(uid)
+    u = get_current_user()
     if not u or u.role not in ('teacher', 'admin'):
         return redirect(url_for('login'))
     # find current subject by timetable
@@ -783,15 +1245,16 @@ def teacher_take_attendance():
 
     # recent attendance (today) - show last 50 records
     today_iso = date.today().isoformat()
-    recent = Attendance.query.filter(Attendance.date == today_iso).order_by(Attendance.time.desc()).limit(50).all()
-    return render_template('teacher_take_attendance.html', subject=current_subject or '', subject_time=current_subject_time, timetable=todays, attendance=recent)
+    recent = (Attendance.query.options(joinedload(Attendance.user))
+              .filter(Attendance.date == today_iso).order_by(Attendance.time.desc()).limit(50).all())
+    return render_template('teacher_take_attendance.html', subject=current_subject or '', subject_time=current_subject_time, timetable=todays, attendance=recent,
+                           face_crops=CLIENT_FACE_CROPS)
 
 
 # Teacher dashboard
 @app.route('/teacher/dashboard')
 def teacher_dashboard():
-    uid = session.get('user_id')
-    u = User.query.get(uid)
+    u = get_current_user()
     if not u or u.role not in ('teacher', 'admin'):
         return redirect(url_for('login'))
     # basic stats for teacher
@@ -799,13 +1262,16 @@ def teacher_dashboard():
     # upcoming/today timetable
     todayname = datetime.today().strftime('%A')
     todays = Timetable.query.filter_by(day=todayname).all()
-    return render_template('teacher_dashboard.html', user=u, students_count=students_count, timetable=todays)
+    # today's presence per subject from the summary table
+    today_iso = date.today().isoformat()
+    present_by_subject = {r.subject: r.present for r in AttendanceSubjectDay.query.filter_by(date=today_iso)}
+    return render_template('teacher_dashboard.html', user=u, students_count=students_count, timetable=todays,
+                           present_by_subject=present_by_subject, present_today=sum(present_by_subject.values()))
 
 
 @app.route('/teacher/timetable')
 def teacher_timetable():
-    uid = session.get('user_id')
-    u = User.query.get(uid) if uid else None
+    u = get_current_user()
     if not u or u.role not in ('teacher','admin'):
         return redirect(url_for('login'))
     timetable = Timetable.query.order_by(Timetable.day, Timetable.start).all()
@@ -818,143 +1284,170 @@ def view_timetable():
     uid = session.get('user_id')
     if not uid:
         return redirect(url_for('login'))
-    u = User.query.get(uid)
+    u = get_current_user()
     if not u:
         return redirect(url_for('login'))
     timetable = Timetable.query.order_by(Timetable.day, Timetable.start).all()
     return render_template('timetable.html', timetable=timetable)
 
-# API recognize: receives base64 frame, marks attendance if matches
-@app.route('/api/recognize', methods=['POST'])
-@csrf.exempt
-def api_recognize():
-    payload = request.json
+def read_frame_upload():
+    """Return (img_bytes, subject, transport) for a /api/recognize request.
+
+    Accepted bodies:
+    - raw JPEG bytes (Content-Type image/jpeg or application/octet-stream), subject in ?subject=
+    - multipart/form-data with a 'frame' file (canvas.toBlob) and a 'subject' field
+    - JSON {frame: dataURL/base64, subject} (legacy; ~33% larger on the wire)
+    """
+    ctype = (request.mimetype or '').lower()
+    if ctype in ('image/jpeg', 'image/png', 'application/octet-stream'):
+        return request.get_data(cache=False), request.args.get('subject'), 'binary'
+    if ctype == 'multipart/form-data':
+        f = request.files.get('frame')
+        return (f.read() if f else None), request.form.get('subject') or request.args.get('subject'), 'multipart'
+    payload = request.get_json(silent=True) or {}
     frame_b64 = payload.get('frame')
-    subject = payload.get('subject') or 'General'
     if not frame_b64:
-        return jsonify({'ok': False, 'error': 'no_frame'})
+        return None, payload.get('subject'), 'json'
     header, data = frame_b64.split(',', 1) if ',' in frame_b64 else ('', frame_b64)
-    img_bytes = base64.b64decode(data)
-    img = Image.open(io.BytesIO(img_bytes)).convert('RGB')
-    rgb = np.array(img)  # RGB
-    face_locations = face_recognition.face_locations(rgb)
-    face_encodings = face_recognition.face_encodings(rgb, face_locations)
-    global ENC
-    if not ENC or not ENC.get('encodings'):
-        return jsonify({'ok': False, 'error': 'no_known_faces'})
+    return base64.b64decode(data), payload.get('subject'), 'json'
 
-    # Build per-user encodings map for robust matching
-    user_map = build_user_enc_map(ENC)
-    results = []
-    marked_user_ids = set()
 
-    # Prepare flat encodings list for simple KNN voting (indices map to ENC['names'])
-    flat_names = ENC.get('names', [])
-    flat_encs = ENC.get('encodings', [])
+def parse_crops(blobs, meta):
+    """[(img_bytes, (origin_top, origin_left), (top, right, bottom, left)), ...] from crop
+    images and their JSON metadata ([{origin: [top, left], box: [top, right, bottom, left]}, ...]).
 
-    for enc in face_encodings:
-        # KNN across all known encodings
-        try:
-            all_dists = face_recognition.face_distance(flat_encs, enc)
-        except Exception:
-            all_dists = np.array([])
+    Raises ValueError if they do not line up, a crop is not image bytes or a box is
+    empty or starts above/left of its crop (process_crops checks the far edges once
+    the crop is decoded).
+    """
+    if len(blobs) != len(meta) or len(blobs) > MAX_FACE_CROPS:
+        raise ValueError('crop count')
+    crops = []
+    for blob, m in zip(blobs, meta):
+        origin, box = [int(v) for v in m['origin']], [int(v) for v in m['box']]
+        if len(origin) != 2 or len(box) != 4 or not isinstance(blob, (bytes, bytearray)) or not blob:
+            raise ValueError('crop shape')
+        top, right, bottom, left = box
+        if top >= bottom or left >= right or top < origin[0] or left < origin[1]:
+            raise ValueError('crop box')
+        crops.append((bytes(blob), tuple(origin), tuple(box)))
+    return crops
+
+
+def read_crop_upload():
+    """Face crops of a multipart /api/recognize request ('crop' files + 'crops' JSON), or None."""
+    if (request.mimetype or '').lower() != 'multipart/form-data' or 'crops' not in request.form:
+        return None
+    if not CLIENT_FACE_CROPS:
+        raise PermissionError('face_crops_disabled')
+    return parse_crops([f.read() for f in request.files.getlist('crop')], json.loads(request.form['crops']))
+
+
+# API recognize: receives a frame (raw JPEG, multipart or base64 JSON) or face crops
+# ('crop' files + 'crops' JSON, see parse_crops), marks attendance if matches
+@app.route('/api/recognize', methods=['POST'])
+@csrf.exempt
+def api_recognize():
+    try:
+        crops = read_crop_upload()
+    except PermissionError:
+        return jsonify({'ok': False, 'error': 'face_crops_disabled'}), 400
+    except (ValueError, KeyError, TypeError):
+        return jsonify({'ok': False, 'error': 'bad_crops'}), 400
+    if crops is not None:
+        img_bytes, subject, transport = None, request.form.get('subject') or request.args.get('subject'), 'crops'
+    else:
+        img_bytes, subject, transport = read_frame_upload()
+        if not img_bytes:
+            return jsonify({'ok': False, 'error': 'no_frame'})
+    subject = subject or 'General'
+    # frames of one camera stream share a tracker; without a stream id every frame stands alone
+    stream_id = request.args.get('stream') or request.headers.get('X-Stream-Id')
+    tracker = get_tracker(stream_id, subject) if TRACKING_ENABLED and stream_id else None
+    body, status = recognize_frame(img_bytes, subject, tracker, session.get('user_id'), transport, crops)
+    return jsonify(body), status
+
+
+def next_frame_hint(work_ms):
+    """Milliseconds a client should wait before its next frame, given how long this one took."""
+    hint = max(FRAME_INTERVAL_MIN_MS, work_ms * 1.5) * max(1.0, recognition_pool.load())
+    return int(min(FRAME_INTERVAL_MAX_MS, hint))
 
-        if all_dists.size == 0:
-            results.append({'ok': True, 'marked': False, 'reason': 'no_known_encodings'})
-            continue
 
-        # get top-k nearest encodings
-        k = min(KNN_K, len(all_dists))
-        idxs = np.argsort(all_dists)[:k]
-        top_names = [flat_names[i] for i in idxs]
-        top_dists = [float(all_dists[i]) for i in idxs]
-
-        # voting majority label
-        from collections import Counter
-        cnt = Counter(top_names)
-        majority_name, majority_count = cnt.most_common(1)[0]
-        confidence = majority_count / k
-        avg_dist = float(np.mean(top_dists))
-
-        # Also compute per-user min distance (backup metric)
-        per_user_min = None
-        if user_map:
-            per_user_min_vals = []
-            for username, u_encs in user_map.items():
-                if u_encs.size == 0:
-                    continue
-                d = face_recognition.face_distance(u_encs, enc)
-                if len(d):
-                    per_user_min_vals.append((username, float(np.min(d))))
-            if per_user_min_vals:
-                per_user_min_vals.sort(key=lambda x: x[1])
-                per_user_min = per_user_min_vals[0]
-
-        # Decision logic:
-        # - If avg_dist <= MATCH_THRESHOLD and confidence >= CONFIDENCE_THRESHOLD -> accept
-        # - If avg_dist <= MATCH_THRESHOLD but confidence below threshold -> low_confidence
-        # - Otherwise -> no_match
-        if avg_dist <= MATCH_THRESHOLD and confidence >= CONFIDENCE_THRESHOLD:
-            chosen = majority_name
-            chosen_dist = avg_dist
-            decision = 'accept'
-        elif avg_dist <= MATCH_THRESHOLD and confidence < CONFIDENCE_THRESHOLD:
-            chosen = majority_name
-            chosen_dist = avg_dist
-            decision = 'low_confidence'
-            # Promote low_confidence to accept if per-user min distance strongly supports it
-            if per_user_min and per_user_min[1] <= (MATCH_THRESHOLD * 1.05):
-                chosen = per_user_min[0]
-                chosen_dist = per_user_min[1]
-                decision = 'accept_fallback'
+def recognize_frame(img_bytes, subject, tracker, actor_id, transport, crops=None):
+    """Detect, match and mark the faces of one frame; returns (response body, HTTP status).
+
+    With `crops` (see parse_crops) the client has already found the faces and
+    img_bytes is unused. Shared by POST /api/recognize and the /recognize Socket.IO channel.
+    """
+    tracked, full_detect = tracker.plan() if tracker else ([], True)
+    # decode + detect + encode on the recognition pool so the eventlet hub stays free
+    t0 = time.perf_counter()
+    try:
+        if crops is not None:
+            full_detect = False
+            face_locations, face_encodings, assigned, encoded, timings = recognition_pool.submit(
+                process_crops, crops, tracked, TRACK_IOU)
         else:
-            # try per-user min as fallback if present
-            if per_user_min and per_user_min[1] <= MATCH_THRESHOLD:
-                chosen = per_user_min[0]
-                chosen_dist = per_user_min[1]
-                decision = 'accept_fallback'
-            else:
-                chosen = None
-                chosen_dist = float(np.min(all_dists)) if all_dists.size else None
-                decision = 'no_match'
+            face_locations, face_encodings, assigned, encoded, timings = recognition_pool.submit(
+                process_frame, img_bytes, DETECTION_SCALE, DETECTION_UPSAMPLE, tracked, full_detect, TRACK_IOU)
+    except PoolBusy:
+        return {'ok': False, 'error': 'busy', 'next_frame_ms': FRAME_INTERVAL_MAX_MS}, 503
+    except ValueError:
+        if crops is None:
+            raise
+        # undecodable crop or a face box reaching past its crop (see process_crops)
+        return {'ok': False, 'error': 'bad_crops', 'next_frame_ms': FRAME_INTERVAL_MIN_MS}, 400
+    next_frame_ms = next_frame_hint((time.perf_counter() - t0) * 1000)
+    frame_bytes = sum(len(c[0]) for c in crops) if crops is not None else len(img_bytes)
+    frame_stats = dict(timings, frame_bytes=frame_bytes, transport=transport,
+                       faces=len(face_locations), encoded=sum(encoded), full_detect=full_detect)
+    app.logger.debug('frame: %s', frame_stats)
+    if not ENC or not len(ENC.get('encodings', [])):
+        return {'ok': False, 'error': 'no_known_faces', 'next_frame_ms': FRAME_INTERVAL_MAX_MS}, 200
+
+    # Match every detected face in one batched pass against the prebuilt gallery
+    gallery = ENC['gallery']
+    results = []
+    marked_user_ids = set()
+    new_marks, already_names = [], []
+
+    # fresh matches for encoded faces; faces on a confirmed track reuse its last match
+    hits = match_cache.hits
+    fresh = iter(match_faces(gallery, face_encodings))
+    frame_stats['cache_hits'] = match_cache.hits - hits
+    matches = [next(fresh) if enc else tracker.cached_match(j) for j, enc in zip(assigned, encoded)]
+    if tracker:
+        tracker.update(face_locations, assigned, encoded, matches)
+
+    for match in matches:
+        chosen = match['chosen']
+        chosen_dist = match['dist']
+        decision = match['decision']
+        confidence = match['confidence']
 
         if chosen and decision.startswith('accept'):
-            user = User.query.filter_by(username=chosen).first()
-            if not user:
+            user_id = user_id_for(chosen)
+            if user_id is None:
                 results.append({'ok': False, 'reason': 'no_user_record', 'username': chosen, 'dist': chosen_dist, 'decision': decision})
                 continue
 
             # Avoid marking the same user multiple times within this request
-            if user.id in marked_user_ids:
+            if user_id in marked_user_ids:
                 results.append({'ok': True, 'marked': False, 'reason': 'already_marked_request', 'username': chosen, 'dist': chosen_dist, 'decision': decision})
                 continue
 
             today = date.today().isoformat()
-            exists = Attendance.query.filter_by(user_id=user.id, date=today, subject=subject, status='Present').first()
-            if exists:
-                marked_user_ids.add(user.id)
-                # emit event so front-end can show a popup that user was already marked
-                try:
-                    socketio.emit('attendance_already', {'username': chosen, 'subject': subject, 'date': today})
-                except Exception:
-                    pass
+            if user_id in marked_today(today, subject):
+                marked_user_ids.add(user_id)
+                already_names.append(chosen)
                 results.append({'ok': True, 'marked': False, 'reason': 'already_marked_db', 'username': chosen, 'dist': chosen_dist, 'decision': decision, 'message': 'Already marked present for this subject today'})
                 continue
 
+            # inserted below, in one transaction for the whole frame
             nowt = datetime.now().strftime('%H:%M:%S')
-            att = Attendance(user_id=user.id, subject=subject, date=today, time=nowt, status='Present')
-            db.session.add(att)
-            db.session.commit()
-            marked_user_ids.add(user.id)
-
-            # emit socket event so teacher/admin/student dashboards can update in real time
-            socketio.emit('attendance_marked', {'username': chosen, 'subject': subject, 'date': today, 'time': nowt})
-            try:
-                socketio.emit('attendance_popup', {'username': chosen, 'subject': subject, 'date': today, 'time': nowt, 'message': 'Attendance recorded'})
-            except Exception:
-                pass
-            # send email
-            send_attendance_email_to_user(user, today, subject)
+            new_marks.append((len(results), user_id, chosen, today, nowt))
+            marked_user_ids.add(user_id)
             results.append({'ok': True, 'marked': True, 'username': chosen, 'dist': chosen_dist, 'confidence': confidence, 'decision': decision, 'message': 'Attendance recorded'})
         else:
             # no match or low confidence
@@ -971,7 +1464,116 @@ def api_recognize():
                 extra['message'] = 'Not marked.'
             results.append(extra)
 
-    return jsonify({'ok': True, 'results': results})
+    # notification mails are queued in the same transaction as the attendance rows
+    users = {u.id: u for u in User.query.filter(User.id.in_([m[1] for m in new_marks])).all()} if new_marks else {}
+    queued = []
+    inserted = insert_attendance([{'user_id': user_id, 'subject': subject, 'date': today, 'time': nowt, 'status': 'Present'}
+                                  for _, user_id, _, today, nowt in new_marks],
+                                 stage=lambda r: queued.append(queue_attendance_email(users.get(r['user_id']), r['date'], r['subject'])))
+    marked_events = []
+    for (i, user_id, username, today, nowt), ok in zip(new_marks, inserted):
+        if not ok:
+            # recorded by someone else between our check and the insert
+            r = results[i]
+            results[i] = {'ok': True, 'marked': False, 'reason': 'already_marked_db', 'username': username, 'dist': r['dist'], 'decision': r['decision'], 'message': 'Already marked present for this subject today'}
+            already_names.append(username)
+            continue
+        note_marked(user_id, today, subject)
+        marked_events.append((user_id, username, nowt))
+    # one socket event for the whole frame, to the rooms watching this class
+    emit_frame_events(actor_id, subject, date.today().isoformat(), marked_events, already_names)
+    if any(queued) and any(inserted):
+        kick_mail_worker()
+
+    return {'ok': True, 'results': results, 'frame_stats': frame_stats, 'next_frame_ms': next_frame_ms}, 200
+
+# ---------------- streaming recognition (Socket.IO) ----------------
+# The teacher live view streams frames over the '/recognize' namespace instead of
+# one HTTP POST per frame:
+#   client -> 'start' {subject}                  (ack: {ok, subject})
+#   client -> 'frame' {seq, data: <JPEG bytes>}  (binary attachment, no base64)
+#          or 'frame' {seq, crops: [{data, origin, box}]}  (face crops, see parse_crops)
+#   server -> 'result' {seq, dropped, ...the /api/recognize response body}
+# Each connection keeps its subject, tracker and the students already reported on
+# it. One frame per connection is processed at a time; frames arriving meanwhile
+# replace each other, so a slow server skips stale frames instead of queueing them.
+RECOGNITION_STREAMS = {}
+
+
+@socketio.on('connect', namespace='/recognize')
+def recognize_connect(auth=None):
+    user = get_current_user()
+    if not user or user.role not in ('teacher', 'admin'):
+        return False
+    RECOGNITION_STREAMS[request.sid] = {'subject': 'General', 'pending': None, 'busy': False,
+                                        'dropped': 0, 'reported': set(), 'user_id': user.id}
+
+
+@socketio.on('disconnect', namespace='/recognize')
+def recognize_disconnect():
+    stream = RECOGNITION_STREAMS.pop(request.sid, None)
+    if stream:
+        drop_tracker((stream['user_id'], 'ws:' + request.sid, stream['subject']))
+
+
+@socketio.on('start', namespace='/recognize')
+def recognize_start(data):
+    stream = RECOGNITION_STREAMS.get(request.sid)
+    if stream is None:
+        return {'ok': False, 'error': 'Unauthorized'}
+    subject = (data or {}).get('subject') or 'General'
+    if subject != stream['subject']:
+        drop_tracker((stream['user_id'], 'ws:' + request.sid, stream['subject']))
+        stream.update(subject=subject, pending=None, reported=set())
+    return {'ok': True, 'subject': subject}
+
+
+@socketio.on('frame', namespace='/recognize')
+def recognize_stream_frame(data):
+    stream = RECOGNITION_STREAMS.get(request.sid)
+    data = data or {}
+    img_bytes, crops = data.get('data'), None
+    if 'crops' in data:
+        if not CLIENT_FACE_CROPS:
+            emit('result', {'ok': False, 'error': 'face_crops_disabled', 'seq': data.get('seq')})
+            return
+        try:
+            crops = parse_crops([c.get('data') for c in data['crops']], data['crops'])
+        except (ValueError, KeyError, TypeError, AttributeError):
+            emit('result', {'ok': False, 'error': 'bad_crops', 'seq': data.get('seq')})
+            return
+    elif not isinstance(img_bytes, (bytes, bytearray)):
+        return
+    if stream is None:
+        return
+    if stream['pending'] is not None:
+        stream['dropped'] += 1
+    stream['pending'] = (data.get('seq'), bytes(img_bytes) if crops is None else None, crops)
+    if stream['busy']:
+        return  # the handler already running for this connection picks it up
+    stream['busy'] = True
+    seq = None
+    try:
+        while stream['pending'] is not None and request.sid in RECOGNITION_STREAMS:
+            seq, img_bytes, crops = stream['pending']
+            stream['pending'] = None
+            subject = stream['subject']
+            tracker = get_tracker('ws:' + request.sid, subject) if TRACKING_ENABLED else None
+            body, _status = recognize_frame(img_bytes, subject, tracker, stream['user_id'],
+                                            'socket' if crops is None else 'socket-crops', crops)
+            for r in body.get('results', []):
+                # a student stays in view for many frames: flag notices this connection has already shown
+                if r.get('marked') or r.get('reason') == 'already_marked_db':
+                    r['repeat'] = r.get('username') in stream['reported']
+                    stream['reported'].add(r.get('username'))
+            body.update(seq=seq, dropped=stream['dropped'])
+            emit('result', body)
+    except Exception:
+        app.logger.exception('Streaming recognition failed')
+        # echo seq so the client stops counting the frame as in flight
+        emit('result', {'ok': False, 'error': 'server_error', 'seq': seq})
+    finally:
+        stream['busy'] = False
 
 # API train: accepts frames for a username, saves images and rebuilds encodings
 @app.route('/api/train', methods=['POST'])
@@ -996,17 +1598,32 @@ def api_train():
         with open(os.path.join(folder, fname), 'wb') as f:
             f.write(data)
         saved += 1
-    build_encodings_from_images()
-    global ENC
-    ENC = load_encodings()
-    return jsonify({'ok':True,'saved':saved})
+    job = submit_train_job(f'train:{username}')
+    return jsonify({'ok':True,'saved':saved,'job_id':job['id'],'status':job['status']})
+
+
+# API train status: progress of a background encodings rebuild
+@app.route('/api/train/status/<job_id>')
+def api_train_status(job_id):
+    job = TRAIN_JOBS.get(job_id)
+    if not job:
+        return jsonify({'ok': False, 'error': 'no_job'}), 404
+    return jsonify({'ok': True, 'job': train_job_view(job)})
+
+
+# API recognize stats: match cache counters (admin only)
+@app.route('/api/recognize/stats')
+def api_recognize_stats():
+    u = get_current_user()
+    if not u or u.role != 'admin':
+        return jsonify({'ok': False, 'error': 'Unauthorized'}), 403
+    return jsonify({'ok': True, 'match_cache': match_cache.stats(), 'trackers': len(TRACKERS)})
 
 
 # API confirm mark: teacher/admin can manually confirm a username to mark attendance
 @app.route('/api/confirm_mark', methods=['POST'])
 def api_confirm_mark():
-    uid = session.get('user_id')
-    actor = User.query.get(uid) if uid else None
+    actor = get_current_user()
     if not actor or actor.role not in ('teacher', 'admin'):
         return jsonify({'ok': False, 'error': 'Unauthorized'}), 403
 
@@ -1021,16 +1638,25 @@ def api_confirm_mark():
         return jsonify({'ok': False, 'error': 'no_user'}), 404
 
     today = date.today().isoformat()
-    exists = Attendance.query.filter_by(user_id=student.id, date=today, subject=subject, status='Present').first()
-    if exists:
+    if student.id in marked_today(today, subject):
         return jsonify({'ok': True, 'marked': False, 'reason': 'already_marked_db'})
 
     nowt = datetime.now().strftime('%H:%M:%S')
     att = Attendance(user_id=student.id, subject=subject, date=today, time=nowt, status='Present')
     db.session.add(att)
-    db.session.commit()
-
-    # Record manual confirmation audit
+    action = 'create'
+    try:
+        db.session.flush()  # assigns att.id for the audit row; the unique index rejects duplicates
+        attendance_summary.apply(db.session, [attendance_summary.row_delta(att, 1)])
+    except IntegrityError:
+        db.session.rollback()
+        att = upgrade_to_present(student.id, today, subject, nowt)
+        if att is None:
+            note_marked(student.id, today, subject)
+            return jsonify({'ok': True, 'marked': False, 'reason': 'already_marked_db'})
+        action = 'update'
+
+    # Record manual confirmation audit, committed with the attendance row
     try:
         mc = ManualConfirmation(actor_id=actor.id if actor else None,
                                  student_id=student.id,
@@ -1038,35 +1664,33 @@ def api_confirm_mark():
                                  date=today,
                                  time=nowt)
         db.session.add(mc)
-        db.session.commit()
     except Exception:
         app.logger.exception('Failed to record manual confirmation audit')
-    try:
-        ea = EditAudit(actor_id=actor.id if actor else None, action='create', target_type='attendance', target_id=att.id, details=f'manual_confirm by {actor.username if actor else None}')
-        db.session.add(ea)
-        db.session.commit()
-    except Exception:
-        app.logger.exception('Failed to record EditAudit for manual confirmation')
+    add_audit(actor, action, 'attendance', att.id, f'manual_confirm by {actor.username if actor else None}', 'manual confirmation')
+    queued = queue_attendance_email(student, today, subject)
+    db.session.commit()
+    note_marked(student.id, today, subject)
 
     # broadcast and notify
-    socketio.emit('attendance_marked', {'username': student.username, 'subject': subject, 'date': today, 'time': nowt})
-    send_attendance_email_to_user(student, today, subject)
+    emit_frame_events(actor.id, subject, today, [(student.id, student.username, nowt)], [])
+    if queued:
+        kick_mail_worker()
 
     return jsonify({'ok': True, 'marked': True, 'username': student.username})
 
 
 @app.route('/admin/manual_confirmations')
 def admin_manual_confirmations():
-    uid = session.get('user_id')
-    admin = User.query.get(uid) if uid else None
+    admin = get_current_user()
     if not admin or admin.role != 'admin':
         return jsonify({'ok': False, 'error': 'Unauthorized'}), 403
 
-    entries = ManualConfirmation.query.order_by(ManualConfirmation.created_at.desc()).limit(200).all()
+    entries = (ManualConfirmation.query
+               .options(joinedload(ManualConfirmation.actor), joinedload(ManualConfirmation.student))
+               .order_by(ManualConfirmation.created_at.desc()).limit(200).all())
     out = []
     for e in entries:
-        actor = User.query.get(e.actor_id) if e.actor_id else None
-        student = User.query.get(e.student_id) if e.student_id else None
+        actor, student = e.actor, e.student
         out.append({
             'id': e.id,
             'actor': actor.username if actor else None,
@@ -1078,44 +1702,204 @@ def admin_manual_confirmations():
         })
     return jsonify({'ok': True, 'entries': out})
 
+# ---------------- history APIs (keyset pagination) ----------------
+# Pages are ordered newest first by a unique key (e.g. date, time, id). The
+# cursor is the key of the last row returned, and the next page continues with
+# "key < cursor", which the indexes seek to directly: page 1000 costs the same
+# as page 1, unlike OFFSET. Responses: {'ok', 'items', 'next_cursor' (None on
+# the last page)}. Date filters are inclusive YYYY-MM-DD.
+HISTORY_PAGE_DEFAULT = 50
+HISTORY_PAGE_MAX = 200
+
+
+class BadHistoryQuery(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [datetime.fromisoformat(v) if isinstance(c.type, db.DateTime) else v for v, c in zip(values, columns)]
+    except (ValueError, TypeError):
+        raise BadHistoryQuery('bad_cursor')
+
+
+def cursor_key(cursor, columns):
+    """The row key a cursor encodes, as a SQL tuple comparable with tuple_(*columns)."""
+    return tuple_(*[literal(v, c.type) for v, c in zip(decode_cursor(cursor, columns), columns)])
+
+
+def parse_day(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise BadHistoryQuery(f'bad_{name}')
+
+
+def keyset_page(query, columns, serialize):
+    """One page of `query`, newest first by `columns` (the last one unique), as a JSON response."""
+    limit = min(max(request.args.get('limit', HISTORY_PAGE_DEFAULT, type=int), 1), HISTORY_PAGE_MAX)
+    cursor = request.args.get('cursor')
+    if cursor:
+        query = query.filter(tuple_(*columns) < cursor_key(cursor, columns))
+    rows = query.order_by(*[c.desc() for c in columns]).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor([getattr(rows[-1], c.key) for c in columns])
+    return jsonify({'ok': True, 'items': [serialize(r) for r in rows], 'next_cursor': next_cursor})
+
+
+def user_filter(name):
+    """User id for the ?<name>=username filter; False if no such user (empty result)."""
+    username = request.args.get(name)
+    if not username:
+        return None
+    user = User.query.filter_by(username=username).first()
+    return user.id if user else False
+
+
+def created_range(query, column):
+    start, end = parse_day('from'), parse_day('to')
+    if start:
+        query = query.filter(column >= datetime.combine(start, datetime.min.time()))
+    if end:
+        query = query.filter(column < datetime.combine(end + timedelta(days=1), datetime.min.time()))
+    return query
+
+
+@app.errorhandler(BadHistoryQuery)
+def bad_history_query(e):
+    return jsonify({'ok': False, 'error': str(e)}), 400
+
+
+# API attendance history: ?from=&to=&subject=&user=&limit=&cursor= (admin/teacher)
+@app.route('/api/attendance')
+def api_attendance():
+    u = get_current_user()
+    if not u or u.role not in ('admin', 'teacher'):
+        return jsonify({'ok': False, 'error': 'Unauthorized'}), 403
+    query = Attendance.query.options(joinedload(Attendance.user))
+    start, end = parse_day('from'), parse_day('to')
+    if start:
+        query = query.filter(Attendance.date >= start.isoformat())
+    if end:
+        query = query.filter(Attendance.date <= end.isoformat())
+    if request.args.get('subject'):
+        query = query.filter(Attendance.subject == request.args['subject'])
+    user_id = user_filter('user')
+    if user_id is False:
+        return jsonify({'ok': True, 'items': [], 'next_cursor': None})
+    if user_id:
+        query = query.filter(Attendance.user_id == user_id)
+    return keyset_page(query, [Attendance.date, Attendance.time, Attendance.id], lambda a: {
+        'id': a.id, 'username': a.user.username if a.user else None, 'subject': a.subject,
+        'date': a.date, 'time': a.time, 'status': a.status})
+
+
+# API manual confirmation history: ?from=&to=&subject=&student=&actor=&limit=&cursor= (admin)
+@app.route('/api/manual_confirmations')
+def api_manual_confirmations():
+    u = get_current_user()
+    if not u or u.role != 'admin':
+        return jsonify({'ok': False, 'error': 'Unauthorized'}), 403
+    query = ManualConfirmation.query.options(joinedload(ManualConfirmation.actor), joinedload(ManualConfirmation.student))
+    query = created_range(query, ManualConfirmation.created_at)
+    if request.args.get('subject'):
+        query = query.filter(ManualConfirmation.subject == request.args['subject'])
+    for name, column in (('student', ManualConfirmation.student_id), ('actor', ManualConfirmation.actor_id)):
+        user_id = user_filter(name)
+        if user_id is False:
+            return jsonify({'ok': True, 'items': [], 'next_cursor': None})
+        if user_id:
+            query = query.filter(column == user_id)
+    return keyset_page(query, [ManualConfirmation.created_at, ManualConfirmation.id], lambda e: {
+        'id': e.id, 'actor': e.actor.username if e.actor else None,
+        'student': e.student.username if e.student else None, 'subject': e.subject,
+        'date': e.date, 'time': e.time, 'created_at': e.created_at.isoformat() if e.created_at else None})
+
+
+# API edit audit history: ?from=&to=&actor=&action=&target_type=&limit=&cursor= (admin)
+@app.route('/api/edit_audit')
+def api_edit_audit():
+    u = get_current_user()
+    if not u or u.role != 'admin':
+        return jsonify({'ok': False, 'error': 'Unauthorized'}), 403
+    query = created_range(EditAudit.query.options(joinedload(EditAudit.actor)), EditAudit.created_at)
+    for name in ('action', 'target_type'):
+        if request.args.get(name):
+            query = query.filter(getattr(EditAudit, name) == request.args[name])
+    user_id = user_filter('actor')
+    if user_id is False:
+        return jsonify({'ok': True, 'items': [], 'next_cursor': None})
+    if user_id:
+        query = query.filter(EditAudit.actor_id == user_id)
+    return keyset_page(query, [EditAudit.created_at, EditAudit.id], lambda e: {
+        'id': e.id, 'actor': e.actor.username if e.actor else None, 'action': e.action,
+        'target_type': e.target_type, 'target_id': e.target_id, 'details': e.details,
+        'created_at': e.created_at.isoformat() if e.created_at else None})
+
+
 # list student attendance (student dashboard)
 @app.route('/student')
 def student_dashboard():
     uid = session.get('user_id')
     if not uid:
         return redirect(url_for('login'))
-    user = User.query.get(uid)
+    user = get_current_user()
     if user.role != 'student':
         return redirect(url_for('login'))
     
-    # Get all attendance records for this student
-    atts = Attendance.query.filter_by(user_id=user.id).order_by(Attendance.date.desc()).all()
-    
-    # Calculate statistics
-    total_attendance = len(atts)
-    present_count = len([a for a in atts if a.status == 'Present'])
-    absent_count = len([a for a in atts if a.status != 'Present'])
-    attendance_percentage = int((present_count / total_attendance * 100)) if total_attendance > 0 else 0
-    
-    # Calculate attendance by subject
+    # Statistics come from the maintained per-(student, subject) summary: one row per subject
     attendance_by_subject = {}
-    for att in atts:
-        if att.subject not in attendance_by_subject:
-            attendance_by_subject[att.subject] = {'total': 0, 'present': 0, 'absent': 0, 'percentage': 0}
-        attendance_by_subject[att.subject]['total'] += 1
-        if att.status == 'Present':
-            attendance_by_subject[att.subject]['present'] += 1
+    for row in AttendanceStudentSubject.query.filter_by(user_id=user.id).order_by(AttendanceStudentSubject.subject):
+        total = row.present + row.absent
+        attendance_by_subject[row.subject] = {'total': total, 'present': row.present, 'absent': row.absent,
+                                              'percentage': int(row.present / total * 100) if total else 0}
+
+    total_attendance = sum(d['total'] for d in attendance_by_subject.values())
+    present_count = sum(d['present'] for d in attendance_by_subject.values())
+    absent_count = total_attendance - present_count
+    attendance_percentage = int((present_count / total_attendance * 100)) if total_attendance > 0 else 0
+
+    # One page of records, newest first, by the history APIs' keyset: ?older=<cursor>
+    # continues after a page's last row and ?newer=<cursor> goes back before its
+    # first, so a deep page costs the same as the first one
+    columns = [Attendance.date, Attendance.time, Attendance.id]
+    query = Attendance.query.filter_by(user_id=user.id)
+    per_page = STUDENT_RECORDS_PER_PAGE
+    try:
+        if request.args.get('newer'):
+            atts = (query.filter(tuple_(*columns) > cursor_key(request.args['newer'], columns))
+                    .order_by(*columns).limit(per_page + 1).all())
+            has_newer, has_older = len(atts) > per_page, True
+            atts = atts[:per_page][::-1]
         else:
-            attendance_by_subject[att.subject]['absent'] += 1
-    
-    # Calculate percentage for each subject
-    for subject in attendance_by_subject:
-        data = attendance_by_subject[subject]
-        data['percentage'] = int((data['present'] / data['total'] * 100)) if data['total'] > 0 else 0
-    
+            if request.args.get('older'):
+                query = query.filter(tuple_(*columns) < cursor_key(request.args['older'], columns))
+            atts = query.order_by(*[c.desc() for c in columns]).limit(per_page + 1).all()
+            has_newer, has_older = bool(request.args.get('older')), len(atts) > per_page
+            atts = atts[:per_page]
+    except BadHistoryQuery:
+        return redirect(url_for('student_dashboard'))
+    newer_cursor = encode_cursor([getattr(atts[0], c.key) for c in columns]) if has_newer and atts else None
+    older_cursor = encode_cursor([getattr(atts[-1], c.key) for c in columns]) if has_older and atts else None
+
     return render_template('student_dashboard.html', 
                          user=user, 
                          attendance=atts,
+                         newer_cursor=newer_cursor,
+                         older_cursor=older_cursor,
                          total_attendance=total_attendance,
                          present_count=present_count,
                          absent_count=absent_count,
@@ -1130,8 +1914,7 @@ def face_file(filename):
 # Delete user (admin only)
 @app.route('/admin/delete_user/<int:user_id>', methods=['POST'])
 def delete_user(user_id):
-    uid = session.get('user_id')
-    admin = User.query.get(uid)
+    admin = get_current_user()
     if not admin or admin.role != 'admin':
         return jsonify({'ok': False, 'error': 'Unauthorized'})
     
@@ -1141,7 +1924,8 @@ def delete_user(user_id):
         if user.role == 'admin':
             return jsonify({'ok': False, 'error': 'Cannot delete admin users'})
         
-        # Delete all attendance records for this user
+        # Delete all attendance records for this user (and their share of the summaries)
+        attendance_summary.apply(db.session, attendance_summary.user_deltas(db.session, user_id))
         Attendance.query.filter_by(user_id=user_id).delete()
         
         # Delete user face data from filesystem
@@ -1150,35 +1934,36 @@ def delete_user(user_id):
             import shutil
             shutil.rmtree(user_folder)
         
-        # Record audit before deletion
-        try:
-            ea = EditAudit(actor_id=admin.id if admin else None, action='delete', target_type='user', target_id=user.id, details=f'deleted user {user.username}')
-            db.session.add(ea)
-            db.session.commit()
-        except Exception:
-            app.logger.exception('Audit failed for user delete')
-
-        # Delete user from database
+        # Delete user from database; attendance rows, audit and user go in one transaction
+        add_audit(admin, 'delete', 'user', user.id, f'deleted user {user.username}', 'user delete')
         db.session.delete(user)
         db.session.commit()
         
-        # Rebuild encodings
-        build_encodings_from_images()
-        global ENC
-        ENC = load_encodings()
+        # Forget cached matches and ids now; the background rebuild reloads ENC
+        match_cache.clear()
+        with _trackers_lock:
+            TRACKERS.clear()
+        MARKED_TODAY.clear()
+        ENC.get('user_ids', {}).pop(user.username, None)
+        submit_train_job(f'delete:{user.username}')
         
         return jsonify({'ok': True, 'message': f'User {user.username} deleted successfully'})
     
     return jsonify({'ok': False, 'error': 'User not found'})
 
 # ---------- init & run -------------
-with app.app_context():
-    db.create_all()
-    # initial build encodings if not exist
-    enc = load_encodings()
-    if not enc['encodings']:
-        build_encodings_from_images()
-        ENC = load_encodings()
+if not MP_WORKER:
+    with app.app_context():
+        db.create_all()
+        # summary tables added to a database that already has attendance: fill them once
+        if attendance_summary.is_empty(db.session) and db.session.query(Attendance.id).first():
+            attendance_summary.rebuild(db.session)
+            db.session.commit()
+            app.logger.info('attendance summaries rebuilt')
+        # initial build encodings if not exist
+        enc = load_encodings()
+        if not len(enc['encodings']):
+            refresh_encodings()
 
 if __name__ == '__main__':
     # use socketio server (eventlet)
@@ -0,0 +1,105 @@
+"""Materialized attendance counts, kept in step with the attendance table.
+
+Three summary tables (models in app.py):
+
+    attendance_subject_day      (date, subject)    -> present, absent
+    attendance_student_subject  (user_id, subject) -> present, absent
+    attendance_day              (date)             -> present, absent
+
+Every write path calls `apply()` in the same transaction as its attendance
+change, with one delta per affected row: (user_id, date, subject, status, +n/-n).
+An update is the old row with -1 plus the new row with +1. Counters are bumped
+with INSERT ... ON CONFLICT DO UPDATE (SQLite >= 3.24, PostgreSQL) and rows
+that drop to zero are removed, so the tables look exactly like a GROUP BY over
+attendance. `rebuild()` recomputes them from scratch and `drift()` counts
+rows that differ from the raw attendance rows; see rebuild_summaries.py.
+"""
+from collections import defaultdict
+from sqlalchemy import text
+
+TABLES = {
+    'attendance_subject_day': ('date', 'subject'),
+    'attendance_student_subject': ('user_id', 'subject'),
+    'attendance_day': ('date',),
+}
+
+# GROUP BY over attendance producing each table's rows; NULL subject/date are stored as ''
+_PRESENT = "SUM(CASE WHEN status = 'Present' THEN 1 ELSE 0 END)"
+_ABSENT = "SUM(CASE WHEN status = 'Present' THEN 0 ELSE 1 END)"
+_SOURCES = {
+    'attendance_subject_day': f"SELECT COALESCE(date, '') AS date, COALESCE(subject, '') AS subject, {_PRESENT} AS present, {_ABSENT} AS absent "
+                              f"FROM attendance GROUP BY COALESCE(date, ''), COALESCE(subject, '')",
+    'attendance_student_subject': f"SELECT user_id, COALESCE(subject, '') AS subject, {_PRESENT} AS present, {_ABSENT} AS absent "
+                                  f"FROM attendance WHERE user_id IS NOT NULL GROUP BY user_id, COALESCE(subject, '')",
+    'attendance_day': f"SELECT COALESCE(date, '') AS date, {_PRESENT} AS present, {_ABSENT} AS absent "
+                      f"FROM attendance GROUP BY COALESCE(date, '')",
+}
+
+
+def _upsert_sql(table, keys):
+    cols = ', '.join(keys)
+    vals = ', '.join(':' + k for k in keys)
+    return text(f"INSERT INTO {table} ({cols}, present, absent) VALUES ({vals}, :present, :absent) "
+                f"ON CONFLICT ({cols}) DO UPDATE SET present = {table}.present + excluded.present, "
+                f"absent = {table}.absent + excluded.absent")
+
+
+def _prune_sql(table, keys):
+    where = ' AND '.join(f'{k} = :{k}' for k in keys)
+    return text(f"DELETE FROM {table} WHERE {where} AND present <= 0 AND absent <= 0")
+
+
+def apply(session, deltas):
+    """Add (user_id, date, subject, status, n) deltas to the summary tables."""
+    acc = {table: defaultdict(lambda: [0, 0]) for table in TABLES}
+    for user_id, day, subject, status, n in deltas:
+        day, subject = day or '', subject or ''
+        i = 0 if status == 'Present' else 1
+        acc['attendance_subject_day'][(day, subject)][i] += n
+        acc['attendance_day'][(day,)][i] += n
+        if user_id is not None:
+            acc['attendance_student_subject'][(user_id, subject)][i] += n
+    for table, keys in TABLES.items():
+        params = [dict(zip(keys, key), present=p, absent=a) for key, (p, a) in acc[table].items() if p or a]
+        if not params:
+            continue
+        session.execute(_upsert_sql(table, keys), params)
+        if any(p['present'] < 0 or p['absent'] < 0 for p in params):
+            session.execute(_prune_sql(table, keys), [{k: p[k] for k in keys} for p in params])
+
+
+def row_delta(att, n):
+    """Delta for one Attendance row (n = +1 inserted, -1 removed)."""
+    return (att.user_id, att.date, att.subject, att.status, n)
+
+
+def user_deltas(session, user_id):
+    """Deltas removing every attendance row of a user (before a bulk delete)."""
+    rows = session.execute(text("SELECT date, subject, status, COUNT(*) FROM attendance WHERE user_id = :u "
+                                "GROUP BY date, subject, status"), {'u': user_id}).fetchall()
+    return [(user_id, d, s, st, -n) for d, s, st, n in rows]
+
+
+def rebuild(session):
+    """Recompute every summary table from the attendance table (caller commits)."""
+    for table, keys in TABLES.items():
+        cols = ', '.join(keys)
+        session.execute(text(f"DELETE FROM {table}"))
+        session.execute(text(f"INSERT INTO {table} ({cols}, present, absent) SELECT {cols}, present, absent FROM ({_SOURCES[table]}) AS src"))
+
+
+def drift(session):
+    """Per table, how many rows differ between the stored counts and a fresh GROUP BY (0 = in sync)."""
+    out = {}
+    for table, keys in TABLES.items():
+        cols = ', '.join(keys) + ', present, absent'
+        n = 0
+        for a, b in ((f"SELECT {cols} FROM ({_SOURCES[table]}) AS src", f"SELECT {cols} FROM {table}"),
+                     (f"SELECT {cols} FROM {table}", f"SELECT {cols} FROM ({_SOURCES[table]}) AS src")):
+            n += session.execute(text(f"SELECT COUNT(*) FROM ({a} EXCEPT {b}) AS d")).scalar()
+        out[table] = n
+    return out
+
+
+def is_empty(session):
+    return session.execute(text("SELECT 1 FROM attendance_day LIMIT 1")).first() is None
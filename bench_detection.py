@@ -0,0 +1,80 @@
+"""Benchmark detection latency vs. recall for DETECTION_SCALE / DETECTION_UPSAMPLE.
+
+- Runs face detection over every image in `face_data/` for each combination of
+  scale and upsample, using the same code path as /api/recognize
+  (`recognition.detect_faces`).
+- The reference is full-resolution detection with upsample=1 (the old default).
+- For each setting prints:
+    det ms    - mean / p95 detection time per image
+    recall    - share of reference faces found again (box IoU >= 0.5)
+    extra     - detections with no reference face
+    enc drift - mean distance between the full-resolution encoding computed from
+                the mapped-back box and the reference encoding (well below
+                MATCH_THRESHOLD means matching is unaffected)
+
+Usage:
+    python bench_detection.py
+    python bench_detection.py --scales 1,0.75,0.5,0.35 --upsample 0,1,2 --limit 200
+"""
+import os, sys, time, argparse
+import numpy as np
+import face_recognition
+from recognition import decode_frame, detect_faces
+from tracking import iou
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+FACE_DIR = os.path.join(BASE, 'face_data')
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+parser.add_argument('--scales', default='1,0.75,0.5,0.35')
+parser.add_argument('--upsample', default='0,1,2')
+parser.add_argument('--limit', type=int, default=0, help='use at most this many images (0 = all)')
+args = parser.parse_args()
+
+paths = []
+for username in sorted(os.listdir(FACE_DIR)):
+    folder = os.path.join(FACE_DIR, username)
+    if os.path.isdir(folder):
+        paths += [os.path.join(folder, f) for f in sorted(os.listdir(folder)) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+if args.limit:
+    paths = paths[:args.limit]
+if not paths:
+    print('No images found in face_data/.')
+    sys.exit(1)
+
+frames = []
+for p in paths:
+    with open(p, 'rb') as f:
+        frames.append(decode_frame(f.read()))
+h, w = frames[0].shape[:2]
+print(f"{len(frames)} images (first is {w}x{h})\n")
+
+
+reference = [face_recognition.face_locations(rgb, number_of_times_to_upsample=1) for rgb in frames]
+ref_encs = [face_recognition.face_encodings(rgb, locs) for rgb, locs in zip(frames, reference)]
+total_ref = sum(len(r) for r in reference)
+
+print(f"{'scale':>6}{'upsample':>10}{'det ms':>9}{'p95 ms':>9}{'recall':>9}{'extra':>7}{'enc drift':>11}")
+for scale in [float(x) for x in args.scales.split(',')]:
+    for up in [int(x) for x in args.upsample.split(',')]:
+        times, found, extra, drift = [], 0, 0, []
+        for rgb, ref, encs in zip(frames, reference, ref_encs):
+            t0 = time.perf_counter()
+            boxes = detect_faces(rgb, scale, up)
+            times.append((time.perf_counter() - t0) * 1000)
+            used = set()
+            for box in boxes:
+                best = max(range(len(ref)), key=lambda i: iou(box, ref[i]), default=None)
+                if best is None or best in used or iou(box, ref[best]) < 0.5:
+                    extra += 1
+                    continue
+                used.add(best)
+                found += 1
+                enc = face_recognition.face_encodings(rgb, [box])[0]
+                drift.append(float(np.linalg.norm(enc - encs[best])))
+        recall = found / total_ref if total_ref else 0.0
+        print(f"{scale:>6.2f}{up:>10d}{np.mean(times):>9.1f}{np.percentile(times, 95):>9.1f}"
+              f"{recall:>9.3f}{extra:>7d}{(np.mean(drift) if drift else float('nan')):>11.4f}")
+
+print('\nPick the cheapest setting whose recall stays ~1.0 for your rooms, then set')
+print('DETECTION_SCALE / DETECTION_UPSAMPLE in .env.')
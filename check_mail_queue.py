@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Check the mail queue against a local SMTP server (needs `pip install aiosmtpd`).
+
+Runs on a throwaway database (see scripts_common.py), starts an aiosmtpd
+server on localhost and points the app's mail settings at it, then drains the
+outbox directly (no scheduler):
+
+1. plain mails plus several attendance notices for one student go out over a
+   single SMTP connection, the notices coalesced into one digest mail
+2. a recipient the server refuses is retried with backoff; the others are sent
+3. with the server down the whole batch is rescheduled, and sent once it is back
+
+Exits 1 if any check fails.
+
+Usage:
+    python check_mail_queue.py
+"""
+import sys, socket
+from datetime import datetime, timedelta
+import scripts_common
+
+try:
+    from aiosmtpd.controller import Controller
+except ImportError:
+    print('❌ aiosmtpd is not installed: pip install aiosmtpd')
+    sys.exit(2)
+
+with socket.socket() as s:
+    s.bind(('127.0.0.1', 0))
+    PORT = s.getsockname()[1]
+scripts_common.make_temp_app('mailq-', {'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': str(PORT), 'MAIL_USE_TLS': '0',
+                                        'MAIL_USERNAME': '', 'MAIL_DEFAULT_SENDER': 'attendance@localhost'})
+
+from app import app, db, User, OutboxMail, queue_mail, queue_attendance_email, build_outbox_message, mail
+import mail_queue
+
+
+class Recorder:
+    def __init__(self):
+        self.messages, self.sessions = [], set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('refused@'):
+            return '550 mailbox unavailable'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        self.messages.append((envelope.rcpt_tos, envelope.content.decode('utf8', 'replace')))
+        return '250 Message accepted'
+
+
+failed = 0
+
+
+def check(ok, label):
+    global failed
+    failed += not ok
+    print(f"{'✅' if ok else '❌'} {label}")
+
+
+def drain(now=None):
+    return mail_queue.drain(db.session, OutboxMail, mail.connect, build_outbox_message,
+                            max_attempts=3, backoff_secs=30, now=now)
+
+
+handler = Recorder()
+server = Controller(handler, hostname='127.0.0.1', port=PORT)
+server.start()
+with app.app_context():
+    db.create_all()
+    student = User(username='mq_student', password='x', role='student', email='student@localhost')
+    db.session.add(student)
+    for i in range(3):
+        queue_mail(f'user{i}@localhost', f'Mail {i}', f'<p>mail {i}</p>')
+    for subject in ('Maths', 'Physics', 'Chemistry'):
+        queue_attendance_email(student, datetime.now().strftime('%Y-%m-%d'), subject)
+    db.session.commit()
+
+    # 1. one connection, notices coalesced
+    stats = drain()
+    check(stats['sent'] == 6 and len(handler.messages) == 4, f"6 rows sent as {len(handler.messages)} mails (expected 4): {stats}")
+    check(len(handler.sessions) == 1, f"{len(handler.sessions)} SMTP connection(s) for the batch")
+    digest = [body for rcpt, body in handler.messages if rcpt == ['student@localhost']]
+    check(len(digest) == 1 and all(s in digest[0] for s in ('Maths', 'Physics', 'Chemistry')), 'attendance digest lists all classes')
+
+    # 2. refused recipient
+    handler.messages.clear()
+    queue_mail('refused@localhost', 'Refused', '<p>x</p>')
+    queue_mail('ok@localhost', 'Accepted', '<p>x</p>')
+    db.session.commit()
+    stats = drain()
+    row = OutboxMail.query.filter_by(recipient='refused@localhost').one()
+    check(stats == {'sent': 1, 'retry': 1, 'failed': 0}, f'refused recipient retried, other sent: {stats}')
+    check(row.attempts == 1 and row.send_after > datetime.utcnow() + timedelta(seconds=20), 'retry scheduled with backoff')
+    later = datetime.utcnow() + timedelta(hours=2)
+    drain(now=later)
+    drain(now=later + timedelta(hours=2))
+    db.session.refresh(row)
+    check(row.status == 'failed' and row.attempts == 3, f'gave up after max attempts ({row.status}, {row.attempts})')
+
+    # 3. server down, then back
+    server.stop()
+    queue_mail('down@localhost', 'While down', '<p>x</p>')
+    db.session.commit()
+    stats = drain()
+    check(stats == {'sent': 0, 'retry': 1, 'failed': 0}, f'batch rescheduled while server is down: {stats}')
+    server = Controller(handler, hostname='127.0.0.1', port=PORT)
+    server.start()
+    handler.messages.clear()
+    stats = drain(now=datetime.utcnow() + timedelta(minutes=5))
+    check(stats['sent'] == 1 and handler.messages[-1][0] == ['down@localhost'], f'sent once the server is back: {stats}')
+    print('outbox:', mail_queue.counts(db.session, OutboxMail))
+server.stop()
+
+sys.exit(1 if failed else 0)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""Check that the main views run a fixed number of SQL queries.
+
+Runs on a throwaway database (see scripts_common.py), filled with enough
+users, attendance and manual confirmations that an N+1 pattern would show,
+requests each view as the right role and compares the number of queries with
+its budget. Exits 1 if any view goes over, printing the statements it ran.
+
+Usage:
+    python check_query_counts.py [-v]
+"""
+import sys
+from datetime import date, timedelta
+import scripts_common
+
+scripts_common.make_temp_app('qcount-')
+from app import app, db, User, ManualConfirmation, Timetable, insert_attendance
+from db_setup import count_queries
+
+ROWS = 300  # well above every page/list limit, so per-row queries cannot hide
+
+# view -> (role, max queries); budgets do not depend on ROWS
+BUDGETS = {
+    '/admin': ('admin', 8),
+    '/admin/manual_confirmations': ('admin', 2),
+    '/teacher/take': ('teacher', 4),
+    '/teacher/dashboard': ('teacher', 5),
+    '/student': ('student', 4),
+    '/timetable': ('student', 3),
+}
+
+verbose = '-v' in sys.argv[1:]
+app.config['WTF_CSRF_ENABLED'] = False
+
+with app.app_context():
+    users = {role: User(username=f'q_{role}', password='x', role=role) for role in ('admin', 'teacher', 'student')}
+    students = [User(username=f'q_student{i}', password='x', role='student') for i in range(20)]
+    db.session.add_all(list(users.values()) + students)
+    db.session.commit()
+    ids = {role: u.id for role, u in users.items()}
+    today = date.today()
+    rows = [{'user_id': students[i % len(students)].id if i % 4 else ids['student'], 'subject': f'Subject{i % 5}',
+             'date': (today - timedelta(days=i // 5)).isoformat(), 'time': '09:00:00',
+             'status': 'Present' if i % 3 else 'Absent'} for i in range(ROWS)]
+    insert_attendance(rows)
+    db.session.add_all([ManualConfirmation(actor_id=ids['teacher'], student_id=students[i % len(students)].id,
+                                           subject='Subject0', date=today.isoformat(), time='09:00:00') for i in range(ROWS)])
+    db.session.add(Timetable(day=today.strftime('%A'), start='00:00', end='23:59', subject='Subject0'))
+    db.session.commit()
+
+failed = 0
+client = app.test_client()
+for path, (role, budget) in BUDGETS.items():
+    with client.session_transaction() as sess:
+        sess['user_id'] = ids[role]
+    with app.app_context():
+        with count_queries(db.engine) as queries:
+            resp = client.get(path)
+    ok = resp.status_code == 200 and len(queries) <= budget
+    failed += not ok
+    print(f"{'✅' if ok else '❌'} {path:<30} {resp.status_code}  {len(queries):>3} queries (budget {budget})")
+    if verbose or not ok:
+        for q in queries:
+            print('      ' + ' '.join(q.split())[:140])
+
+sys.exit(1 if failed else 0)
@@ -0,0 +1,84 @@
+"""Database engine setup: connection pool and SQLite pragmas.
+
+With SQLite's default rollback journal, a writer locks the whole file and
+readers wait on it, so several classrooms marking attendance at once hit
+"database is locked". On every new SQLite connection we set:
+
+    journal_mode  WAL: readers no longer block the writer (and vice versa);
+                  persistent, stored in the database file
+    synchronous   NORMAL is durable across app crashes in WAL mode and syncs
+                  far less often than FULL
+    busy_timeout  how long a writer waits for the lock before failing
+    cache_size    page cache per connection (negative = KiB)
+    mmap_size     memory-mapped reads
+
+Other databases (DATABASE_URL) only get the pool settings.
+"""
+from contextlib import contextmanager
+from sqlalchemy import event
+
+
+def sqlite_pragmas(journal_mode='WAL', synchronous='NORMAL', busy_timeout_ms=5000, cache_size_kb=20000, mmap_size_mb=256):
+    return [
+        f'PRAGMA journal_mode={journal_mode}',
+        f'PRAGMA synchronous={synchronous}',
+        f'PRAGMA busy_timeout={int(busy_timeout_ms)}',
+        f'PRAGMA cache_size=-{int(cache_size_kb)}',
+        f'PRAGMA mmap_size={int(mmap_size_mb) * 1024 * 1024}',
+        'PRAGMA temp_store=MEMORY',
+    ]
+
+
+def engine_options(uri, pool_size=10, max_overflow=20, busy_timeout_ms=5000):
+    """SQLALCHEMY_ENGINE_OPTIONS for `uri`."""
+    if uri.startswith('sqlite'):
+        if ':memory:' in uri or uri in ('sqlite://', 'sqlite:///'):
+            return {}
+        # pysqlite's own lock wait (seconds) backs up PRAGMA busy_timeout
+        return {'pool_size': pool_size, 'max_overflow': max_overflow,
+                'connect_args': {'timeout': busy_timeout_ms / 1000.0, 'check_same_thread': False}}
+    return {'pool_size': pool_size, 'max_overflow': max_overflow, 'pool_pre_ping': True}
+
+
+def install_pragmas(engine, pragmas):
+    """Run `pragmas` on every new connection of a SQLite engine."""
+    if engine.dialect.name != 'sqlite':
+        return
+
+    @event.listens_for(engine, 'connect')
+    def _set_pragmas(dbapi_conn, _record):
+        cur = dbapi_conn.cursor()
+        for p in pragmas:
+            cur.execute(p)
+        cur.close()
+
+
+def sqlite_settings(engine):
+    """Current pragma values as seen by a pooled connection (for diagnostics)."""
+    if engine.dialect.name != 'sqlite':
+        return {}
+    out = {}
+    with engine.connect() as conn:
+        for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size'):
+            out[name] = conn.exec_driver_sql(f'PRAGMA {name}').scalar()
+    return out
+
+
+@contextmanager
+def count_queries(engine):
+    """Collect the SQL statements run on `engine` inside the block.
+
+        with count_queries(db.engine) as queries:
+            client.get('/admin')
+        assert len(queries) <= 8, queries
+    """
+    queries = []
+
+    def _record(conn, cursor, statement, parameters, context, executemany):
+        queries.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', _record)
+    try:
+        yield queries
+    finally:
+        event.remove(engine, 'before_cursor_execute', _record)
@@ -0,0 +1,129 @@
+"""Binary on-disk store for face encodings.
+
+Layout inside `models/`:
+    encodings.meta.json      - header: format version, dim, count, usernames and
+                               the file names of the current generation
+    encodings-<gen>.npy      - float32 matrix (count x dim), memory-mapped at load
+    labels-<gen>.npy         - int32 array, row -> index into meta["usernames"]
+
+The meta file is written last with an atomic rename, so readers always see a
+complete generation. Older generations are removed best-effort (on Windows a
+file that is still memory-mapped cannot be deleted; it is cleaned up next save).
+
+The legacy `models/encodings.json` is migrated automatically the first time the
+store is loaded, or explicitly with:
+    python encoding_store.py
+"""
+import os, json, time, glob
+import numpy as np
+
+BASE = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE, 'models')
+LEGACY_JSON = 'encodings.json'
+META_FILE = 'encodings.meta.json'
+FORMAT = 'face-encodings'
+VERSION = 1
+DIM = 128
+DTYPE = np.float32
+
+
+def _empty():
+    return {"names": [], "encodings": np.zeros((0, DIM), dtype=DTYPE),
+            "labels": np.zeros(0, dtype=np.int32), "usernames": []}
+
+
+def _atomic_save_npy(path, arr):
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, arr)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _cleanup_old(model_dir, keep):
+    for pattern in ('encodings-*.npy', 'labels-*.npy'):
+        for p in glob.glob(os.path.join(model_dir, pattern)):
+            if os.path.basename(p) in keep:
+                continue
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+
+
+def save_encodings(names, encodings, model_dir=MODEL_DIR):
+    """Write a new generation of the store. `encodings` may be a list of vectors or a 2-D array."""
+    os.makedirs(model_dir, exist_ok=True)
+    if len(encodings):
+        mat = np.ascontiguousarray(np.asarray(encodings, dtype=DTYPE).reshape(len(encodings), -1))
+    else:
+        mat = np.zeros((0, DIM), dtype=DTYPE)
+    if mat.shape[0] != len(names):
+        raise ValueError(f'names ({len(names)}) and encodings ({mat.shape[0]}) differ in length')
+    usernames = sorted(set(names))
+    index = {u: i for i, u in enumerate(usernames)}
+    labels = np.array([index[n] for n in names], dtype=np.int32)
+
+    gen = str(int(time.time() * 1000))
+    enc_name = f'encodings-{gen}.npy'
+    lbl_name = f'labels-{gen}.npy'
+    _atomic_save_npy(os.path.join(model_dir, enc_name), mat)
+    _atomic_save_npy(os.path.join(model_dir, lbl_name), labels)
+
+    meta = {"format": FORMAT, "version": VERSION, "dim": int(mat.shape[1]), "dtype": 'float32',
+            "count": int(mat.shape[0]), "usernames": usernames,
+            "matrix": enc_name, "labels": lbl_name}
+    meta_path = os.path.join(model_dir, META_FILE)
+    tmp = meta_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(meta, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, meta_path)
+    _cleanup_old(model_dir, keep={enc_name, lbl_name})
+
+
+def migrate_json(model_dir=MODEL_DIR):
+    """One-shot conversion of the legacy JSON file. Returns the number of encodings migrated."""
+    path = os.path.join(model_dir, LEGACY_JSON)
+    if not os.path.exists(path):
+        return 0
+    with open(path, 'r') as f:
+        data = json.load(f)
+    names = data.get('names', [])
+    save_encodings(names, data.get('encodings', []), model_dir)
+    return len(names)
+
+
+def load_encodings(model_dir=MODEL_DIR, mmap=True):
+    """Load the store as {"names", "encodings", "labels", "usernames"}.
+
+    `encodings` is a read-only (count x dim) float32 matrix, memory-mapped unless
+    `mmap` is False; `names` is the per-row username list the app has always used.
+    """
+    meta_path = os.path.join(model_dir, META_FILE)
+    if not os.path.exists(meta_path):
+        if not migrate_json(model_dir):
+            return _empty()
+    with open(meta_path, 'r') as f:
+        meta = json.load(f)
+    if meta.get('format') != FORMAT or meta.get('version') != VERSION:
+        raise ValueError(f'unsupported encodings store: {meta.get("format")} v{meta.get("version")}')
+    if not meta.get('count'):
+        return _empty()
+    mat = np.load(os.path.join(model_dir, meta['matrix']), mmap_mode='r' if mmap else None)
+    labels = np.load(os.path.join(model_dir, meta['labels']))
+    if mat.shape != (meta['count'], meta['dim']) or labels.shape != (meta['count'],):
+        raise ValueError('encodings store is inconsistent with its header')
+    usernames = meta['usernames']
+    names = [usernames[i] for i in labels.tolist()]
+    return {"names": names, "encodings": mat, "labels": labels, "usernames": usernames}
+
+
+if __name__ == '__main__':
+    n = migrate_json()
+    if n:
+        print(f'Migrated {n} encodings from {os.path.join(MODEL_DIR, LEGACY_JSON)}')
+    else:
+        print('No legacy encodings.json found; nothing to migrate.')
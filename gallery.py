@@ -0,0 +1,202 @@
+"""Precomputed gallery of known face encodings for fast matching.
+
+Built once whenever the encodings are (re)loaded. Rows are grouped by user so
+each user's encodings are a contiguous slice of one float32 matrix; squared
+norms are cached so a distance pass is a single matrix product:
+
+    |q - g|^2 = |q|^2 + |g|^2 - 2 q.g
+
+That float32 pass only picks candidates. Rows within RERANK_SLACK_SQ of the
+k-th are measured again as norm(q - g) in float64, as face_recognition's
+face_distance does, so the k nearest, their distances and every threshold
+decision match the per-face path.
+
+Two index backends share the same interface (see `build_gallery`):
+    exact - brute force over every row (default)
+    ivf   - k-means inverted file: rows are bucketed by nearest centroid and a
+            query only scans the rows of its `nprobe` nearest buckets. Raise
+            `nprobe` for recall, lower it for latency; use `python ann_report.py`
+            to measure recall against exact search.
+"""
+import numpy as np
+
+# float32 rounding moves a squared distance by ~1e-6 for face encodings; candidates
+# this close to the k-th (squared) are re-measured before the top k are chosen
+RERANK_SLACK_SQ = 1e-4
+
+
+class Gallery:
+    backend = 'exact'
+
+    def __init__(self, names, encodings):
+        names = list(names)
+        encs = np.asarray(encodings, dtype=np.float32).reshape(len(names), -1) if names else np.zeros((0, 128), dtype=np.float32)
+        self.usernames = sorted(set(names))
+        index = {u: i for i, u in enumerate(self.usernames)}
+        raw_labels = np.array([index[n] for n in names], dtype=np.int32)
+        # stable sort keeps each user's rows in their original order
+        order = np.argsort(raw_labels, kind='stable')
+        self.matrix = np.ascontiguousarray(encs[order])
+        self.labels = raw_labels[order]
+        self.sq_norms = np.einsum('ij,ij->i', self.matrix, self.matrix)
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def distances(self, queries):
+        """Euclidean distances from one query (dim,) or a batch (Q, dim) to every row."""
+        q = np.asarray(queries, dtype=np.float32)
+        single = q.ndim == 1
+        q = np.atleast_2d(q)
+        d2 = np.einsum('ij,ij->i', q, q)[:, None] + self.sq_norms[None, :] - 2.0 * (q @ self.matrix.T)
+        np.maximum(d2, 0.0, out=d2)
+        d = np.sqrt(d2)
+        return d[0] if single else d
+
+    def _rerank(self, q, rows, approx, k):
+        """The k nearest of `rows` to one float64 query by exact distance, given
+        their float32 distances `approx`; returns (rows, dists), nearest first."""
+        approx_sq = np.square(approx, dtype=np.float64)
+        kth = np.partition(approx_sq, k - 1)[k - 1] if k < len(rows) else approx_sq.max()
+        rows = rows[approx_sq <= kth + RERANK_SLACK_SQ]
+        exact = np.linalg.norm(self.matrix[rows].astype(np.float64) - q, axis=1)
+        order = np.argsort(exact, kind='stable')[:k]
+        return rows[order], exact[order]
+
+    def search(self, queries, k):
+        """The k nearest rows for a batch of queries (Q, dim), nearest first.
+
+        Returns (top_idx, top_dist), both (Q, k), with float64 distances. Only the
+        rows near the k-th are re-measured and sorted.
+        """
+        q = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+        dists = self.distances(q)
+        k = min(k, dists.shape[1])
+        rows = np.arange(dists.shape[1])
+        top_idx = np.empty((q.shape[0], k), dtype=np.int64)
+        top_dist = np.empty((q.shape[0], k), dtype=np.float64)
+        for i in range(q.shape[0]):
+            top_idx[i], top_dist[i] = self._rerank(q[i], rows, dists[i], k)
+        return top_idx, top_dist
+
+    def vote(self, top_idx, top_dist):
+        """Majority vote over each row of a (Q, k) nearest-neighbour result.
+
+        Returns (majority_label, majority_count, avg_dist). Ties in the vote go to
+        the label seen first in nearest-first order, which is what
+        collections.Counter.most_common(1) did on the per-face path.
+        """
+        top_lbl = self.labels[top_idx]
+        counts = (top_lbl[:, :, None] == top_lbl[:, None, :]).sum(axis=2)
+        first_max = np.argmax(counts == counts.max(axis=1, keepdims=True), axis=1)
+        rows = np.arange(top_idx.shape[0])
+        return top_lbl[rows, first_max], counts[rows, first_max], top_dist.mean(axis=1)
+
+    def match(self, queries, k, match_threshold, confidence_threshold):
+        """Match a batch of query encodings (Q, dim) in one pass.
+
+        Returns one dict per query with keys chosen, dist, decision, confidence.
+        Decision logic:
+        - avg KNN dist <= match_threshold and confidence >= confidence_threshold -> accept
+        - avg KNN dist <= match_threshold but confidence below threshold -> low_confidence,
+          promoted to accept_fallback if the per-user min distance is within 5% of the threshold
+        - otherwise accept_fallback if the per-user min distance <= match_threshold, else no_match
+
+        The best per-user minimum is simply the user of the nearest row, so it
+        comes out of the same top-k search.
+        """
+        if not len(queries) or not len(self):
+            return []
+        top_idx, top_dist = self.search(np.atleast_2d(np.asarray(queries)), k)
+        k = top_idx.shape[1]
+        maj_label, maj_count, avg_dist = self.vote(top_idx, top_dist)
+        confidence = maj_count / k
+        best_user = self.labels[top_idx[:, 0]]
+        best_user_dist = top_dist[:, 0]
+
+        within = avg_dist <= match_threshold
+        confident = confidence >= confidence_threshold
+        promote = within & ~confident & (best_user_dist <= match_threshold * 1.05)
+        fallback = ~within & (best_user_dist <= match_threshold)
+        use_user_min = promote | fallback
+        decision = np.select([within & confident, promote, within, fallback],
+                             ['accept', 'accept_fallback', 'low_confidence', 'accept_fallback'], 'no_match')
+        chosen_label = np.where(use_user_min, best_user, maj_label)
+        chosen_dist = np.where(use_user_min | (decision == 'no_match'), best_user_dist, avg_dist)
+
+        out = []
+        for i in range(len(decision)):
+            d = str(decision[i])
+            out.append({'chosen': self.usernames[chosen_label[i]] if d != 'no_match' else None,
+                        'dist': float(chosen_dist[i]),
+                        'decision': d,
+                        'confidence': float(confidence[i])})
+        return out
+
+
+def _kmeans(x, nlist, iters=20, seed=0):
+    """Plain Lloyd's k-means; returns (centroids, assignment)."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), nlist, replace=False)].copy()
+    x_sq = np.einsum('ij,ij->i', x, x)
+    for _ in range(iters):
+        d2 = x_sq[:, None] + np.einsum('ij,ij->i', centroids, centroids)[None, :] - 2.0 * (x @ centroids.T)
+        assign = np.argmin(d2, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        # re-seed empty buckets from random rows so every list stays useful
+        if empty.any():
+            centroids[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+    return centroids, assign
+
+
+class IVFGallery(Gallery):
+    backend = 'ivf'
+
+    def __init__(self, names, encodings, nlist=None, nprobe=8, iters=20, seed=0):
+        super().__init__(names, encodings)
+        n = len(self)
+        self.nlist = max(1, min(n, nlist or int(np.sqrt(n))))
+        self.nprobe = max(1, min(nprobe, self.nlist))
+        if n:
+            self.centroids, assign = _kmeans(self.matrix, self.nlist, iters, seed)
+        else:
+            self.centroids, assign = np.zeros((0, self.matrix.shape[1]), dtype=np.float32), np.zeros(0, dtype=np.int64)
+        self.lists = [np.flatnonzero(assign == c) for c in range(self.nlist)]
+        self.list_sizes = np.array([len(l) for l in self.lists])
+
+    def candidates(self, centroid_dists, min_candidates=1):
+        """Row indices scanned for one query: its nprobe nearest lists, widened
+        until at least `min_candidates` rows are covered."""
+        order = np.argsort(centroid_dists)
+        probe = max(self.nprobe, int(np.searchsorted(np.cumsum(self.list_sizes[order]), min_candidates)) + 1)
+        return np.concatenate([self.lists[c] for c in order[:probe]])
+
+    def search(self, queries, k):
+        q64 = np.atleast_2d(np.asarray(queries, dtype=np.float64))
+        q = q64.astype(np.float32)
+        k = min(k, len(self))
+        q_sq = np.einsum('ij,ij->i', q, q)
+        cd = q_sq[:, None] + np.einsum('ij,ij->i', self.centroids, self.centroids)[None, :] - 2.0 * (q @ self.centroids.T)
+        top_idx = np.empty((q.shape[0], k), dtype=np.int64)
+        top_dist = np.empty((q.shape[0], k), dtype=np.float64)
+        for i in range(q.shape[0]):
+            rows = self.candidates(cd[i], k)
+            d = np.sqrt(np.maximum(q_sq[i] + self.sq_norms[rows] - 2.0 * (self.matrix[rows] @ q[i]), 0.0))
+            top_idx[i], top_dist[i] = self._rerank(q64[i], rows, d, k)
+        return top_idx, top_dist
+
+
+BACKENDS = {'exact': Gallery, 'ivf': IVFGallery}
+
+
+def build_gallery(names, encodings, backend='exact', **opts):
+    """Build a gallery with the named index backend ('exact' or 'ivf')."""
+    if backend not in BACKENDS:
+        raise ValueError(f'unknown gallery backend: {backend}')
+    if backend == 'exact':
+        return Gallery(names, encodings)
+    return BACKENDS[backend](names, encodings, **opts)
@@ -0,0 +1,70 @@
+"""Socket.IO rooms and per-frame batching of live attendance events.
+
+Rooms (joined on connect, see app.py):
+
+    admins            every admin connection
+    teacher:<id>      every connection of one teacher
+    student:<id>      every connection of one student
+
+A recognition frame produces at most one 'attendance_frame' event
+
+    {'subject', 'date', 'marked': [{'username', 'time'}], 'already': [username, ...]}
+
+sent once to the union of the camera teacher's room and 'admins', plus one
+'attendance_marked' per newly marked student to that student's room. Students
+standing in view are re-recognized on every frame; `AlreadyFilter` lets each
+one into 'already' once per (teacher, subject, day) every `ttl` seconds, and
+an event with nothing new is not sent at all.
+"""
+import threading
+import time
+
+
+def user_rooms(user):
+    """Rooms a connection of `user` joins on connect."""
+    if user.role == 'admin':
+        return ['admins']
+    if user.role == 'teacher':
+        return [f'teacher:{user.id}']
+    return [f'student:{user.id}']
+
+
+def frame_rooms(actor_id):
+    rooms = ['admins']
+    if actor_id is not None:
+        rooms.append(f'teacher:{actor_id}')
+    return rooms
+
+
+def frame_event(subject, day, marked, already):
+    """Payload for one frame, or None if there is nothing to tell."""
+    if not marked and not already:
+        return None
+    return {'subject': subject, 'date': day, 'marked': marked, 'already': already}
+
+
+class AlreadyFilter:
+    """Drops repeat 'already marked' notices for `ttl` seconds per key."""
+
+    def __init__(self, ttl=300):
+        self.ttl = ttl
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def fresh(self, keys, now=None):
+        """The subset of `keys` not reported in the last `ttl` seconds (and remember them)."""
+        now = time.time() if now is None else now
+        out = []
+        with self._lock:
+            if len(self._seen) > 10000:
+                self._seen = {k: t for k, t in self._seen.items() if now - t < self.ttl}
+            for key in keys:
+                last = self._seen.get(key)
+                if last is None or now - last >= self.ttl:
+                    self._seen[key] = now
+                    out.append(key)
+        return out
+
+    def clear(self):
+        with self._lock:
+            self._seen.clear()
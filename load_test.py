@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""Load test: N simulated teachers at once, to compare database settings.
+
+Two modes:
+
+- HTTP (default): every teacher thread POSTs a JPEG frame to /api/recognize on
+  a running server in a loop, like client_recog.js. With --unique-subjects each
+  request uses a new subject, so every recognized face inserts an attendance
+  row (the write-heavy case); otherwise faces are marked once and later frames
+  are read-only.
+- --db: no server; every teacher thread inserts attendance + audit rows through
+  the app's SQLAlchemy engine, updates the summary tables and commits, as
+  api_recognize / api_confirm_mark do. This isolates SQLite write throughput and "database is locked" errors.
+
+Prints requests (or transactions) per second, latency p50/p95/p99 and errors. Rows
+are written with subjects 'LoadTest-...'; remove them with --cleanup.
+
+Usage:
+    python load_test.py --url http://localhost:5001 --image face_data/alice/1.jpg --teachers 20 --seconds 30
+    python load_test.py --db --teachers 20 --seconds 10
+    SQLITE_JOURNAL_MODE=DELETE SQLITE_SYNCHRONOUS=FULL python load_test.py --db   # old defaults, for "before"
+    python load_test.py --cleanup
+"""
+import sys, time, uuid, argparse, threading
+import urllib.request, urllib.error
+from collections import Counter
+import numpy as np
+
+parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+parser.add_argument('--url', default='http://localhost:5001')
+parser.add_argument('--image', help='JPEG frame to send (HTTP mode)')
+parser.add_argument('--teachers', type=int, default=10)
+parser.add_argument('--seconds', type=float, default=20)
+parser.add_argument('--interval', type=float, default=0.4, help='pause between frames per teacher (HTTP mode)')
+parser.add_argument('--unique-subjects', action='store_true', help='new subject per request so every match inserts')
+parser.add_argument('--db', action='store_true', help='write directly through the app engine instead of HTTP')
+parser.add_argument('--cleanup', action='store_true', help="delete rows written by earlier runs and exit")
+args = parser.parse_args()
+
+latencies, outcomes = [], Counter()
+lock = threading.Lock()
+
+
+def record(ms, outcome):
+    with lock:
+        latencies.append(ms)
+        outcomes[outcome] += 1
+
+
+def http_teacher(i, frame, deadline):
+    stream = uuid.uuid4().hex
+    n = 0
+    while time.time() < deadline:
+        n += 1
+        subject = f'LoadTest-{i}-{n}' if args.unique_subjects else f'LoadTest-{i}'
+        req = urllib.request.Request(f'{args.url}/api/recognize?subject={subject}&stream={stream}', data=frame,
+                                     headers={'Content-Type': 'image/jpeg'}, method='POST')
+        t0 = time.perf_counter()
+        try:
+            with urllib.request.urlopen(req, timeout=30) as resp:
+                resp.read()
+                outcome = resp.status
+        except urllib.error.HTTPError as e:
+            outcome = e.code
+        except Exception as e:
+            outcome = type(e).__name__
+        record((time.perf_counter() - t0) * 1000, outcome)
+        time.sleep(args.interval)
+
+
+def db_teacher(i, deadline, user_ids):
+    from app import app, db, Attendance, EditAudit
+    import attendance_summary
+    from sqlalchemy.exc import OperationalError
+    n = 0
+    with app.app_context():
+        while time.time() < deadline:
+            n += 1
+            t0 = time.perf_counter()
+            try:
+                att = Attendance(user_id=user_ids[n % len(user_ids)], subject=f'LoadTest-{i}-{n}',
+                                 date=time.strftime('%Y-%m-%d'), time=time.strftime('%H:%M:%S'), status='Present')
+                db.session.add(att)
+                db.session.flush()
+                attendance_summary.apply(db.session, [attendance_summary.row_delta(att, 1)])
+                db.session.add(EditAudit(action='create', target_type='attendance', target_id=att.id, details='load_test'))
+                db.session.commit()
+                outcome = 'ok'
+            except OperationalError as e:
+                db.session.rollback()
+                outcome = 'locked' if 'locked' in str(e) else 'OperationalError'
+            record((time.perf_counter() - t0) * 1000, outcome)
+
+
+if args.cleanup or args.db:
+    from app import app, db, Attendance, EditAudit, User
+    import db_setup
+    import attendance_summary
+    with app.app_context():
+        if args.cleanup:
+            n = Attendance.query.filter(Attendance.subject.like('LoadTest-%')).delete(synchronize_session=False)
+            EditAudit.query.filter_by(details='load_test').delete(synchronize_session=False)
+            attendance_summary.rebuild(db.session)
+            db.session.commit()
+            print(f'Deleted {n} load-test attendance rows.')
+            sys.exit(0)
+        print('SQLite settings:', db_setup.sqlite_settings(db.engine))
+        user_ids = [u.id for u in User.query.limit(50).all()] or [None]
+
+if not args.db:
+    if not args.image:
+        parser.error('--image is required in HTTP mode')
+    with open(args.image, 'rb') as f:
+        frame = f.read()
+
+deadline = time.time() + args.seconds
+if args.db:
+    threads = [threading.Thread(target=db_teacher, args=(i, deadline, user_ids)) for i in range(args.teachers)]
+else:
+    threads = [threading.Thread(target=http_teacher, args=(i, frame, deadline)) for i in range(args.teachers)]
+t0 = time.time()
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+elapsed = time.time() - t0
+
+total = len(latencies)
+print(f"\n{args.teachers} teachers, {elapsed:.1f}s, {total} {'transactions' if args.db else 'requests'} "
+      f"({total / elapsed:.1f}/s)")
+if total:
+    lat = np.array(latencies)
+    print(f"latency ms  p50 {np.percentile(lat, 50):.1f}  p95 {np.percentile(lat, 95):.1f}  "
+          f"p99 {np.percentile(lat, 99):.1f}  max {lat.max():.1f}")
+print('outcomes:', dict(outcomes))
+print("Written rows use subjects 'LoadTest-...'; remove them with: python load_test.py --cleanup")
@@ -0,0 +1,108 @@
+"""Outbound mail queue: an outbox table drained by a background worker.
+
+Request handlers never talk to SMTP. They stage an outbox row in the same
+transaction as the change that triggers the mail (an attendance mark, an OTP),
+and the worker (a scheduler job in app.py) sends what is due:
+
+- one SMTP connection per batch (connect/TLS/login once, then send every mail)
+- a failed mail is retried after backoff_secs * 2^(attempts-1), capped at
+  backoff_cap_secs, and marked 'failed' after max_attempts; if the connection
+  itself cannot be opened, the whole batch is rescheduled the same way
+- due attendance notices to the same recipient are coalesced into one mail;
+  with a daily digest the app delays them to the digest hour so a student gets
+  one mail for all of the day's classes
+
+Each sent mail is committed on its own, so a crash mid-batch re-sends at most
+one mail (at-least-once delivery). Rows: see OutboxMail in app.py.
+"""
+import smtplib
+from datetime import datetime, timedelta
+from sqlalchemy import func
+
+
+def backoff_delay(attempts, base_secs, cap_secs):
+    """Seconds to wait before retry number `attempts` (1 = first retry)."""
+    return min(cap_secs, base_secs * 2 ** max(attempts - 1, 0))
+
+
+def due(session, Outbox, now, limit):
+    return (session.query(Outbox).filter(Outbox.status == 'pending', Outbox.send_after <= now)
+            .order_by(Outbox.send_after, Outbox.id).limit(limit).all())
+
+
+def group(rows):
+    """Split due rows into mails: attendance notices per recipient, everything else one by one."""
+    mails, notices = [], {}
+    for row in rows:
+        if row.kind == 'attendance':
+            if row.recipient not in notices:
+                notices[row.recipient] = []
+                mails.append(notices[row.recipient])
+            notices[row.recipient].append(row)
+        else:
+            mails.append([row])
+    return mails
+
+
+def _connection_lost(error):
+    # SMTPException subclasses OSError; other OSErrors are socket failures
+    return isinstance(error, smtplib.SMTPServerDisconnected) or (
+        isinstance(error, OSError) and not isinstance(error, smtplib.SMTPException))
+
+
+def _retry(rows, error, now, max_attempts, backoff_secs, backoff_cap_secs):
+    for row in rows:
+        row.attempts = (row.attempts or 0) + 1
+        row.last_error = str(error)[:500]
+        if row.attempts >= max_attempts:
+            row.status = 'failed'
+        else:
+            row.send_after = now + timedelta(seconds=backoff_delay(row.attempts, backoff_secs, backoff_cap_secs))
+
+
+def drain(session, Outbox, connect, build, batch_size=50, max_attempts=5, backoff_secs=30, backoff_cap_secs=3600, now=None):
+    """Send up to `batch_size` due rows over one connection; returns counts.
+
+    `connect()` returns a context manager yielding an object with send(message)
+    (Flask-Mail's mail.connect); `build(rows)` returns the message for a group
+    of rows.
+    """
+    now = now or datetime.utcnow()
+    rows = due(session, Outbox, now, batch_size)
+    stats = {'sent': 0, 'retry': 0, 'failed': 0}
+    if not rows:
+        return stats
+    pending = group(rows)
+    try:
+        with connect() as conn:
+            while pending:
+                mail_rows = pending[0]
+                try:
+                    conn.send(build(mail_rows))
+                except Exception as e:
+                    if _connection_lost(e):
+                        raise  # reschedule the rest of the batch below
+                    _retry(mail_rows, e, now, max_attempts, backoff_secs, backoff_cap_secs)
+                else:
+                    sent_at = datetime.utcnow()
+                    for row in mail_rows:
+                        row.status, row.sent_at, row.last_error = 'sent', sent_at, None
+                    stats['sent'] += len(mail_rows)
+                session.commit()
+                pending.pop(0)
+    except Exception as e:
+        session.rollback()
+        for mail_rows in pending:
+            _retry(mail_rows, e, now, max_attempts, backoff_secs, backoff_cap_secs)
+        session.commit()
+    for row in rows:
+        if row.status == 'failed':
+            stats['failed'] += 1
+        elif row.status == 'pending':
+            stats['retry'] += 1
+    return stats
+
+
+def counts(session, Outbox):
+    """Rows per status, for diagnostics."""
+    return dict(session.query(Outbox.status, func.count(Outbox.id)).group_by(Outbox.status).all())
@@ -0,0 +1,103 @@
+"""Cache of recent recognition results, keyed by encoding proximity.
+
+A student in front of the camera produces nearly the same encoding frame after
+frame. MatchCache remembers the last `capacity` resolved query encodings and
+their match dicts (chosen, dist, decision, confidence); a new query within
+`radius` (Euclidean) of a cached one reuses its result instead of running the
+KNN vote again. Entries expire after `ttl` seconds and the least recently used
+one is evicted when full.
+
+The lookup is a brute-force nearest neighbour over the cached keys (a few
+hundred 128-d rows), which is far cheaper than a vote over the whole gallery.
+`radius` should stay well below MATCH_THRESHOLD so a reused result is one the
+vote would almost certainly have produced anyway.
+
+Results are tied to the gallery they were computed against: passing a
+different gallery (ENC reloaded) drops every entry. `clear()` does the same
+explicitly, e.g. when a user is deleted.
+"""
+import time, threading
+from collections import OrderedDict
+import numpy as np
+
+
+class MatchCache:
+    def __init__(self, capacity=256, radius=0.04, ttl=30.0, dim=128):
+        self.capacity = capacity
+        self.radius = radius
+        self.ttl = ttl
+        self.keys = np.zeros((max(1, capacity), dim), dtype=np.float32)
+        self.entries = OrderedDict()   # slot -> (result, expires_at), oldest first
+        self.free = list(range(capacity))
+        self.owner = None
+        self.hits = self.misses = self.invalidations = 0
+        self._lock = threading.Lock()
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def _reset(self):
+        if self.entries:
+            self.invalidations += 1
+        self.entries.clear()
+        self.free = list(range(self.capacity))
+
+    def _lookup(self, queries, now):
+        out = [None] * len(queries)
+        if not self.entries or not len(queries):
+            return out
+        slots = np.fromiter(self.entries.keys(), dtype=np.intp, count=len(self.entries))
+        keys = self.keys[slots]
+        d2 = (np.einsum('ij,ij->i', queries, queries)[:, None]
+              + np.einsum('ij,ij->i', keys, keys)[None, :] - 2.0 * queries @ keys.T)
+        best = d2.argmin(axis=1)
+        for i, b in enumerate(best):
+            if d2[i, b] > self.radius * self.radius:
+                continue
+            slot = int(slots[b])
+            entry = self.entries.get(slot)
+            if entry is None:
+                continue   # expired earlier in this batch
+            if entry[1] < now:
+                del self.entries[slot]
+                self.free.append(slot)
+                continue
+            self.entries.move_to_end(slot)
+            out[i] = dict(entry[0])
+        return out
+
+    def _insert(self, query, result, now):
+        if self.free:
+            slot = self.free.pop()
+        else:
+            slot, _ = self.entries.popitem(last=False)
+        self.keys[slot] = query
+        self.entries[slot] = (dict(result), now + self.ttl)
+
+    def match(self, gallery, queries, compute):
+        """Results for `queries` (Q, dim), calling compute(misses) only for uncached ones."""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.keys.shape[1])
+        if not self.capacity:
+            return compute(queries)
+        now = time.time()
+        with self._lock:
+            if self.owner is not gallery:
+                self._reset()
+                self.owner = gallery
+            results = self._lookup(queries, now)
+        missing = [i for i, r in enumerate(results) if r is None]
+        fresh = compute(queries[missing]) if missing else []
+        with self._lock:
+            self.hits += len(results) - len(missing)
+            self.misses += len(missing)
+            for i, r in zip(missing, fresh):
+                results[i] = r
+                if self.owner is gallery:
+                    self._insert(queries[i], r, now)
+        return results
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'size': len(self.entries), 'capacity': self.capacity, 'invalidations': self.invalidations}
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Measure live Socket.IO traffic for a simulated full classroom.
+
+Runs on a throwaway database (see scripts_common.py), connects Socket.IO test
+clients for one camera teacher, the other teachers, an admin and every
+student, and replays a lesson at the client's frame rate: students walk in one
+by one and then stay in view, so every later frame re-recognizes them.
+
+The same lesson is replayed twice and the Socket.IO packets the server sends
+to all connections (count and encoded size) are compared:
+
+- before: one broadcast per face per frame, to every connection
+  (attendance_marked + attendance_popup on the first sighting,
+  attendance_already on every later frame)
+- after:  emit_frame_events() (rooms, one event per frame, deduplicated
+  attendance_already), as api_recognize now does
+
+Usage:
+    python measure_socket_events.py [--students 40] [--teachers 10] [--minutes 5] [--interval 0.4]
+"""
+import argparse
+import scripts_common
+
+parser = argparse.ArgumentParser(description='Measure live Socket.IO traffic for a simulated classroom.')
+parser.add_argument('--students', type=int, default=40)
+parser.add_argument('--teachers', type=int, default=10, help='connected teachers, one of them running the camera')
+parser.add_argument('--minutes', type=float, default=5)
+parser.add_argument('--interval', type=float, default=0.4, help='seconds between frames')
+parser.add_argument('--arrival', type=float, default=2.0, help='seconds between students entering the frame')
+args = parser.parse_args()
+
+scripts_common.make_temp_app('sockets-')
+from app import app, db, socketio, User, emit_frame_events, already_filter
+
+SUBJECT = 'Physics'
+
+with app.app_context():
+    admin = User(username='s_admin', password='x', role='admin')
+    teachers = [User(username=f's_teacher{i}', password='x', role='teacher') for i in range(args.teachers)]
+    students = [User(username=f's_student{i}', password='x', role='student') for i in range(args.students)]
+    db.session.add_all([admin] + teachers + students)
+    db.session.commit()
+    users = [(u.id, u.username, u.role) for u in [admin] + teachers + students]
+    camera_teacher = teachers[0].id
+    roster = [(u.id, u.username) for u in students]
+
+
+def connect(user_id):
+    http = app.test_client()
+    with http.session_transaction() as sess:
+        sess['user_id'] = user_id
+    # pass the session cookie by hand: Flask-SocketIO 5.3's flask_test_client predates Werkzeug 2.3's cookie jar
+    return socketio.test_client(app, headers={'Cookie': f"{app.config['SESSION_COOKIE_NAME']}={http.get_cookie(app.config['SESSION_COOKIE_NAME']).value}"})
+
+
+clients = [connect(user_id) for user_id, username, role in users]
+
+
+# count every packet the server writes to a connection (what would go on the wire)
+sent = [0, 0]
+
+
+def _count_packet(eio_sid, pkt):
+    sent[0] += 1
+    sent[1] += len(pkt.encode())
+
+
+socketio.server._send_eio_packet = _count_packet
+
+
+def received():
+    out = tuple(sent)
+    sent[:] = [0, 0]
+    return out
+
+
+def legacy_frame(day, marked, already):
+    for _, username, t in marked:
+        socketio.emit('attendance_marked', {'username': username, 'subject': SUBJECT, 'date': day, 'time': t})
+        socketio.emit('attendance_popup', {'username': username, 'subject': SUBJECT, 'date': day, 'time': t, 'message': 'Attendance recorded'})
+    for username in already:
+        socketio.emit('attendance_already', {'username': username, 'subject': SUBJECT, 'date': day})
+
+
+def lesson(emit_frame):
+    frames = int(args.minutes * 60 / args.interval)
+    day = '2026-01-05'
+    marked_ids = set()
+    for f in range(frames):
+        t = f * args.interval
+        in_view = roster[:min(len(roster), int(t / args.arrival) + 1)]
+        clock = f'09:{int(t // 60):02d}:{int(t % 60):02d}'
+        marked = [(uid, name, clock) for uid, name in in_view if uid not in marked_ids]
+        already = [name for uid, name in in_view if uid in marked_ids]
+        marked_ids.update(uid for uid, _, _ in marked)
+        emit_frame(day, marked, already)
+    return frames
+
+
+with app.app_context():
+    received()
+    frames = lesson(legacy_frame)
+    before = received()
+    already_filter.clear()
+    lesson(lambda day, marked, already: emit_frame_events(camera_teacher, SUBJECT, day, marked, already))
+    after = received()
+
+minutes = args.minutes
+print(f"{args.students} students in view, {len(clients)} connections, {frames} frames over {minutes:g} min\n")
+print(f"{'':8}{'events/min':>12}{'KB/min':>10}")
+for label, (events, nbytes) in (('before', before), ('after', after)):
+    print(f"{label:8}{events / minutes:>12.0f}{nbytes / 1024 / minutes:>10.1f}")
+if after[0]:
+    print(f"\n{before[0] / after[0]:.0f}x fewer events, {before[1] / max(after[1], 1):.0f}x fewer bytes")
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Add the Attendance and history indexes to an existing (SQLite) database.
+
+db.create_all() only creates indexes for new tables, so databases created
+before the indexes were declared on the model need this once:
+
+1. normalizes `date` to YYYY-MM-DD and `time` to HH:MM:SS (zero-padded), so
+   string order is chronological and index range scans / ORDER BY work; on
+   SQLite this is exactly how a native DATE/TIME column is stored
+2. removes duplicate (user_id, date, subject) rows, keeping the first Present
+   row (else the first row) of each group
+3. rebuilds the attendance summary tables (see attendance_summary.py)
+4. creates the unique index on (user_id, date, subject), the dashboard and
+   history indexes declared on Attendance, ManualConfirmation and EditAudit,
+   then runs ANALYZE
+5. prints the query plans of the hot queries
+
+Usage:
+    python migrate_attendance.py [--dry-run]
+"""
+import sys, argparse
+from datetime import datetime
+from sqlalchemy import inspect
+from app import app, db, Attendance, ManualConfirmation, EditAudit
+import attendance_summary
+
+parser = argparse.ArgumentParser(description='Add Attendance indexes to an existing database.')
+parser.add_argument('--dry-run', action='store_true', help='only report what would change')
+args = parser.parse_args()
+
+
+def normalize(value, formats, out_fmt):
+    for fmt in formats:
+        try:
+            return datetime.strptime(value, fmt).strftime(out_fmt)
+        except (TypeError, ValueError):
+            continue
+    return None
+
+
+with app.app_context():
+    conn = db.session.connection()
+
+    # 1. canonical date/time strings
+    fixed, bad = 0, []
+    for att_id, d, t in conn.exec_driver_sql('SELECT id, date, time FROM attendance').fetchall():
+        nd = normalize(d, ('%Y-%m-%d', '%Y/%m/%d', '%d-%m-%Y'), '%Y-%m-%d')
+        nt = normalize(t, ('%H:%M:%S', '%H:%M'), '%H:%M:%S') if t else t
+        if nd is None:
+            bad.append((att_id, d))
+            continue
+        if (nd, nt) != (d, t):
+            fixed += 1
+            if not args.dry_run:
+                conn.exec_driver_sql('UPDATE attendance SET date = ?, time = ? WHERE id = ?', (nd, nt, att_id))
+    print(f"Normalized date/time on {fixed} rows")
+    for att_id, d in bad:
+        print(f"⚠️ row {att_id}: unrecognized date {d!r} left as is")
+
+    # 2. duplicates
+    groups = conn.exec_driver_sql(
+        'SELECT user_id, date, subject FROM attendance GROUP BY user_id, date, subject HAVING COUNT(*) > 1').fetchall()
+    removed = 0
+    for user_id, d, subj in groups:
+        rows = conn.exec_driver_sql(
+            'SELECT id, status FROM attendance WHERE user_id IS ? AND date IS ? AND subject IS ? ORDER BY id',
+            (user_id, d, subj)).fetchall()
+        keep = next((r[0] for r in rows if r[1] == 'Present'), rows[0][0])
+        drop = [r[0] for r in rows if r[0] != keep]
+        removed += len(drop)
+        if not args.dry_run:
+            conn.exec_driver_sql(f"DELETE FROM attendance WHERE id IN ({','.join('?' * len(drop))})", tuple(drop))
+    print(f"Removed {removed} duplicate rows in {len(groups)} (user, date, subject) groups")
+
+    if args.dry_run:
+        db.session.rollback()
+        print("Dry run: nothing written.")
+        sys.exit(0)
+    # 3. summaries
+    attendance_summary.rebuild(db.session)
+    db.session.commit()
+    print("Rebuilt attendance summaries")
+
+    # 4. indexes
+    for model in (Attendance, ManualConfirmation, EditAudit):
+        existing = {ix['name'] for ix in inspect(db.engine).get_indexes(model.__tablename__)}
+        for index in model.__table__.indexes:
+            if index.name in existing:
+                print(f"✅ {index.name} already exists")
+                continue
+            index.create(db.engine)
+            print(f"✅ created {index.name}")
+    with db.engine.begin() as c:
+        c.exec_driver_sql('ANALYZE')
+
+    # 5. query plans
+    today = datetime.now().strftime('%Y-%m-%d')
+    queries = {
+        'duplicate check': ('SELECT id FROM attendance WHERE user_id = ? AND date = ? AND subject = ?', (1, today, 'General')),
+        'marked today': ('SELECT user_id FROM attendance WHERE date = ? AND subject = ?', (today, 'General')),
+        'student dashboard': ('SELECT * FROM attendance WHERE user_id = ? ORDER BY date DESC, time DESC LIMIT 20', (1,)),
+        'student stats': ('SELECT subject, COUNT(id), SUM(status = ?) FROM attendance WHERE user_id = ? GROUP BY subject', ('Present', 1)),
+        'admin recent': ('SELECT * FROM attendance ORDER BY date DESC LIMIT 200', ()),
+        'teacher today': ('SELECT * FROM attendance WHERE date = ? ORDER BY time DESC LIMIT 50', (today,)),
+        'history page': ('SELECT * FROM attendance WHERE (date, time, id) < (?, ?, ?) ORDER BY date DESC, time DESC, id DESC LIMIT 50', (today, '12:00:00', 1 << 30)),
+        'history subject': ('SELECT * FROM attendance WHERE subject = ? AND (date, time, id) < (?, ?, ?) ORDER BY date DESC, time DESC, id DESC LIMIT 50', ('General', today, '12:00:00', 1 << 30)),
+        'audit page': ('SELECT * FROM edit_audit WHERE (created_at, id) < (?, ?) ORDER BY created_at DESC, id DESC LIMIT 50', (today, 1 << 30)),
+    }
+    if db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as c:
+            for label, (sql, params) in queries.items():
+                plan = '; '.join(r[-1] for r in c.exec_driver_sql('EXPLAIN QUERY PLAN ' + sql, params).fetchall())
+                print(f"  {label:<18} {plan}")
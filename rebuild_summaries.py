@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""Recompute the attendance summary tables from the attendance table.
+
+The summaries (see attendance_summary.py) are updated incrementally by every
+write path in the app. Rows written or deleted by other means (sqlite shell,
+scripts, restored backups) make them drift; this recomputes them in one
+transaction.
+
+Usage:
+    python rebuild_summaries.py           # rebuild
+    python rebuild_summaries.py --check   # only report drift (exit 1 if any)
+"""
+import sys, argparse
+from app import app, db
+import attendance_summary
+
+parser = argparse.ArgumentParser(description='Recompute the attendance summary tables.')
+parser.add_argument('--check', action='store_true', help='report drift without rebuilding')
+args = parser.parse_args()
+
+with app.app_context():
+    drift = attendance_summary.drift(db.session)
+    for table, n in drift.items():
+        print(f"{'✅' if not n else '⚠️'} {table}: {n} differing rows")
+    if args.check:
+        sys.exit(1 if any(drift.values()) else 0)
+    attendance_summary.rebuild(db.session)
+    db.session.commit()
+    print("✅ Summaries rebuilt")
@@ -0,0 +1,225 @@
+"""Per-frame face detection/encoding, run off the eventlet hub.
+
+The app serves HTTP and Socket.IO from one eventlet hub thread, so running dlib
+inside a request stalls every other client while a frame is processed.
+`RecognitionPool` runs the CPU-heavy part (JPEG decode, HOG detection, ResNet
+encoding) elsewhere:
+
+    process - a pool of worker processes; uses every core (default)
+    thread  - eventlet's OS thread pool (tpool); frees the hub, but dlib holds
+              the GIL so frames do not run in parallel
+    inline  - in the calling thread (tests / debugging)
+
+Clients that find faces themselves (the browser's FaceDetector) upload padded
+face crops instead of frames; `process_crops` encodes those without running
+HOG at all.
+
+Only the JPEG bytes go to a worker and only face boxes and 128-d encodings come
+back; matching stays in the app process where the gallery lives. At most
+`queue_depth` frames may be queued or running; beyond that `submit` raises
+PoolBusy so the caller can shed load instead of piling up stale frames.
+"""
+import io, os, time, threading, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from PIL import Image
+import face_recognition
+from tracking import iou, assign_boxes, pad_box
+
+try:
+    from eventlet import tpool
+except ImportError:  # eventlet is optional outside the server
+    tpool = None
+
+try:
+    import cv2
+except ImportError:  # fall back to PIL decoding
+    cv2 = None
+
+
+class PoolBusy(Exception):
+    pass
+
+
+def decode_frame(img_bytes):
+    """JPEG/PNG bytes -> RGB uint8 array.
+
+    With OpenCV the bytes are wrapped without copying, decoded straight into
+    the output array and converted BGR->RGB in place; PIL is the fallback.
+    """
+    if cv2 is not None:
+        bgr = cv2.imdecode(np.frombuffer(img_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if bgr is not None:
+            return cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB, dst=bgr)
+    img = Image.open(io.BytesIO(img_bytes))
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    return np.asarray(img)
+
+
+def downscale(rgb, scale):
+    h, w = rgb.shape[:2]
+    size = (max(1, int(round(w * scale))), max(1, int(round(h * scale))))
+    if cv2 is not None:
+        return cv2.resize(rgb, size, interpolation=cv2.INTER_AREA)
+    return np.asarray(Image.fromarray(rgb).resize(size, Image.BILINEAR))
+
+
+def detect_faces(rgb, scale=1.0, upsample=1):
+    """HOG face boxes (top, right, bottom, left) in full-resolution coordinates.
+
+    With scale < 1 detection runs on a downsampled copy (much cheaper: HOG cost
+    grows with pixel count) and the boxes are mapped back; `upsample` is
+    face_recognition's number_of_times_to_upsample, raise it for small faces.
+    """
+    if scale >= 1.0:
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=upsample)
+    small = downscale(rgb, scale)
+    sy, sx = rgb.shape[0] / small.shape[0], rgb.shape[1] / small.shape[1]
+    h, w = rgb.shape[:2]
+    out = []
+    for top, right, bottom, left in face_recognition.face_locations(small, number_of_times_to_upsample=upsample):
+        out.append((max(0, int(round(top * sy))), min(w, int(round(right * sx))),
+                    min(h, int(round(bottom * sy))), max(0, int(round(left * sx)))))
+    return out
+
+
+def redetect_faces(rgb, boxes, scale=1.0, upsample=1, pad=0.5):
+    """Look for each tracked box again inside a padded crop around it.
+
+    Returns the boxes found (full-frame coordinates), at most one per tracked
+    box: the detection overlapping it most.
+    """
+    h, w = rgb.shape[:2]
+    out = []
+    for box in boxes:
+        top, right, bottom, left = pad_box(box, pad, h, w)
+        crop = np.ascontiguousarray(rgb[top:bottom, left:right])
+        found = [(t + top, r + left, b + top, l + left) for t, r, b, l in detect_faces(crop, scale, upsample)]
+        if found:
+            best = max(found, key=lambda f: iou(f, box))
+            if best not in out:
+                out.append(best)
+    return out
+
+
+def process_frame(img_bytes, scale=1.0, upsample=1, tracked=(), full_detect=True, iou_threshold=0.3):
+    """Detect faces in a frame and encode those that need it.
+
+    `tracked` is a list of (box, reuse) from the caller's FaceTracker. Unless
+    `full_detect` is set, faces are only searched for around the tracked boxes.
+    Faces matching a reusable track are not encoded. Returns (locations,
+    encodings of the encoded faces as an (n, 128) array, assigned track index
+    per face or -1, encoded flag per face, timings in ms).
+    """
+    t0 = time.perf_counter()
+    rgb = decode_frame(img_bytes)
+    t1 = time.perf_counter()
+    boxes = [box for box, _ in tracked]
+    if full_detect or not boxes:
+        locations = detect_faces(rgb, scale, upsample)
+    else:
+        locations = redetect_faces(rgb, boxes, scale, upsample)
+    assigned = assign_boxes(locations, boxes, iou_threshold)
+    encoded = [j < 0 or not tracked[j][1] for j in assigned]
+    t2 = time.perf_counter()
+    encodings = face_recognition.face_encodings(rgb, [loc for loc, e in zip(locations, encoded) if e])
+    t3 = time.perf_counter()
+    timings = {'decode_ms': round((t1 - t0) * 1000, 2), 'detect_ms': round((t2 - t1) * 1000, 2),
+               'encode_ms': round((t3 - t2) * 1000, 2)}
+    return locations, np.array(encodings).reshape(len(encodings), 128), assigned, encoded, timings
+
+
+def process_crops(crops, tracked=(), iou_threshold=0.3):
+    """Encode faces the client already found, skipping detection.
+
+    `crops` is a list of (img_bytes, (origin_top, origin_left), box): a padded
+    crop of the frame, where its top-left corner sat in the frame, and the face
+    box (top, right, bottom, left) in frame coordinates. Returns the same tuple
+    as process_frame, with locations in frame coordinates so tracking works as
+    for full frames. Raises ValueError for a crop that does not decode or a box
+    that is empty or not inside its crop.
+    """
+    t0 = time.perf_counter()
+    images = []
+    for img_bytes, (oy, ox), (top, right, bottom, left) in crops:
+        try:
+            rgb = decode_frame(img_bytes)
+        except Exception:
+            raise ValueError('crop image')
+        h, w = rgb.shape[:2]
+        if not (oy <= top < bottom <= oy + h and ox <= left < right <= ox + w):
+            raise ValueError('crop box')
+        images.append(rgb)
+    t1 = time.perf_counter()
+    locations = [tuple(box) for _, _, box in crops]
+    assigned = assign_boxes(locations, [box for box, _ in tracked], iou_threshold)
+    encoded = [j < 0 or not tracked[j][1] for j in assigned]
+    encodings = []
+    for rgb, (_, (oy, ox), (top, right, bottom, left)), e in zip(images, crops, encoded):
+        if not e:
+            continue
+        encodings.extend(face_recognition.face_encodings(rgb, [(top - oy, right - ox, bottom - oy, left - ox)]))
+    t2 = time.perf_counter()
+    timings = {'decode_ms': round((t1 - t0) * 1000, 2), 'detect_ms': 0.0, 'encode_ms': round((t2 - t1) * 1000, 2)}
+    return locations, np.array(encodings).reshape(len(encodings), 128), assigned, encoded, timings
+
+
+def _worker_init():
+    # warm up the detector/encoder so the first frame is not slow; best effort
+    try:
+        rgb = np.zeros((150, 150, 3), dtype=np.uint8)
+        face_recognition.face_locations(rgb)
+        face_recognition.face_encodings(rgb, [(0, 150, 150, 0)])
+    except Exception:
+        pass
+
+
+class RecognitionPool:
+    def __init__(self, mode='process', workers=0, queue_depth=8):
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_depth = max(1, queue_depth)
+        self._slots = threading.BoundedSemaphore(self.queue_depth)
+        self._lock = threading.Lock()
+        self.in_flight = 0  # frames queued or running
+        self._executor = None
+        if mode == 'process':
+            # workers start on the first frame, when the scheduler and server threads
+            # are already running: fork could copy a lock one of them holds
+            methods = multiprocessing.get_all_start_methods()
+            ctx = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx, initializer=_worker_init)
+        elif mode == 'thread' and tpool is not None:
+            tpool.set_num_threads(self.workers)
+
+    def _wait(self, fn, *args):
+        # block only this green thread: the actual wait happens on an OS thread
+        if tpool is not None:
+            return tpool.execute(fn, *args)
+        return fn(*args)
+
+    def submit(self, fn, *args):
+        """Run fn(*args) on the pool and return its result, or raise PoolBusy."""
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusy()
+        with self._lock:
+            self.in_flight += 1
+        try:
+            if self._executor is not None:
+                return self._wait(self._executor.submit(fn, *args).result)
+            if self.mode == 'thread':
+                return self._wait(fn, *args)
+            return fn(*args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def load(self):
+        """Frames in flight per worker: above 1.0 frames are waiting for a worker."""
+        return self.in_flight / (1 if self.mode == 'inline' else self.workers)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
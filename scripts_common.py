@@ -0,0 +1,22 @@
+"""Shared setup for the check/measure scripts (check_query_counts.py,
+check_mail_queue.py, measure_socket_events.py).
+
+The app reads its configuration when it is imported, so a script that wants a
+throwaway database has to set DATABASE_URL first; make_temp_app() does that and
+then imports the app, leaving db.sqlite3 untouched.
+"""
+import os
+import tempfile
+
+
+def make_temp_app(prefix, env=None):
+    """Point DATABASE_URL (plus any `env` overrides) at a new temp SQLite file and import app.
+
+    Call it before anything else imports app. Returns the app module; the
+    caller can then `from app import ...` as usual.
+    """
+    tmp_dir = tempfile.mkdtemp(prefix=prefix)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tmp_dir, 'db.sqlite3')
+    os.environ.update(env or {})
+    import app
+    return app
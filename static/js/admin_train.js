@@ -57,6 +57,14 @@ async function captureAndTrain(username, count = 6) {
     });
     
     const result = await res.json();
+    // Encodings are rebuilt by a background job; wait for it so recognition uses the new frames
+    if (result.ok && result.job_id) {
+      const job = await waitForTrainJob(result.job_id);
+      result.job = job;
+      if (job && job.status === 'failed') {
+        return { ok: false, error: `Training failed: ${job.error || 'unknown error'}` };
+      }
+    }
     return result;
   } catch (error) {
     console.error('Training error:', error);
@@ -84,3 +92,21 @@ async function captureAndTrain(username, count = 6) {
     };
   }
 }
+
+// Poll /api/train/status/<id> until the rebuild finishes (or give up after timeoutMs)
+async function waitForTrainJob(jobId, intervalMs = 1000, timeoutMs = 300000) {
+  const started = Date.now();
+  while (Date.now() - started < timeoutMs) {
+    try {
+      const res = await fetch(`/api/train/status/${jobId}`);
+      const body = await res.json();
+      if (body && body.job && (body.job.status === 'done' || body.job.status === 'failed')) {
+        return body.job;
+      }
+    } catch (e) {
+      console.warn('Train status poll failed:', e);
+    }
+    await new Promise(r => setTimeout(r, intervalMs));
+  }
+  return null;
+}
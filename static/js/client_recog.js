@@ -1,6 +1,8 @@
 let streamRef = null;
 
 function startRecognition(subject, onResult) {
+  // lets the server track faces across this camera session's frames
+  const streamId = Math.random().toString(36).slice(2) + Date.now().toString(36);
   const container = document.getElementById('videoContainer');
   container.innerHTML = '';
   
@@ -32,104 +34,267 @@ function startRecognition(subject, onResult) {
       
       let running = true;
       let recognitionInProgress = false;
-      
+
+      function finish(result) {
+        running = false;
+        if (socket) socket.disconnect();
+        streamRef.getTracks().forEach(t => t.stop());
+        if (onResult) onResult(result);
+      }
+
+      // Handles one recognition response; calls finish() once a student is marked.
+      async function handleResponse(j) {
+        // New response format: { ok: true, results: [ { marked: true|false, username, dist, ... }, ... ] }
+        if (j && Array.isArray(j.results)) {
+          // If any face was marked true, stop and return that result
+          const marked = j.results.find(r => r.marked === true);
+          if (marked) {
+            finish(marked);
+            return;
+          }
+
+          // If any face was already marked in DB, show a popup notification
+          // (the streaming channel flags students it has already reported with `repeat`)
+          const alreadyMarked = j.results.find(r => r.reason === 'already_marked_db' && !r.repeat);
+          if (alreadyMarked) {
+            try {
+              // Show a modal that requires the teacher to click OK to proceed to next
+              await showAlreadyMarkedModal(alreadyMarked.username || alreadyMarked.name, subject);
+            } catch (e) {
+              console.warn('Already-marked modal failed:', e);
+            }
+            // continue recognition for other faces after OK
+          }
+
+          // If any low-confidence matches were returned, log and optionally show UI
+          const low = j.results.find(r => r.reason === 'low_confidence' || r.reason === 'accept_fallback');
+          if (low) {
+            console.warn('Low-confidence match:', low);
+            // show a confirmation modal to the teacher/admin
+            showConfirmation(low.username || low.name, low.dist, subject, async (confirmed) => {
+              if (confirmed) {
+                try {
+                  const headers = { 'Content-Type': 'application/json' };
+                  if (window && window.CSRF_TOKEN) headers['X-CSRFToken'] = window.CSRF_TOKEN;
+                  const res = await fetch('/api/confirm_mark', {
+                    method: 'POST',
+                    headers: headers,
+                    body: JSON.stringify({ username: low.username || low.name, subject })
+                  });
+                  const body = await res.json();
+                  if (body && body.marked) {
+                    finish(body);
+                  } else {
+                    console.warn('Confirm mark failed or already marked', body);
+                  }
+                } catch (err) {
+                  console.error('Confirm mark request failed', err);
+                }
+              } else {
+                // teacher rejected, continue recognition
+                console.log('Manual rejection; continuing recognition');
+              }
+            });
+          }
+        } else if (j && j.marked) {
+          // fallback for older format
+          finish(j);
+        }
+      }
+
+      // Frame gating: a 64x48 grayscale thumbnail is compared with the one of the last
+      // frame sent, and a frame is only uploaded when the scene changed (mean luma
+      // difference >= MOTION_THRESHOLD) or every HEARTBEAT_MS. The send interval follows
+      // the server's next_frame_ms hint and the measured response time.
+      const MOTION_THRESHOLD = 6;
+      const HEARTBEAT_MS = 3000;
+      const CHECK_MS = 150;
+      const MAX_INTERVAL_MS = 5000;
+      const thumb = document.createElement('canvas');
+      thumb.width = 64;
+      thumb.height = 48;
+      const thumbCtx = thumb.getContext('2d', { willReadFrequently: true });
+      let lastThumb = null;
+      let lastSentAt = 0;
+      let intervalMs = 400;
+      let responseMs = null;
+
+      function sceneChanged() {
+        thumbCtx.drawImage(video, 0, 0, thumb.width, thumb.height);
+        const px = thumbCtx.getImageData(0, 0, thumb.width, thumb.height).data;
+        const luma = new Uint8Array(thumb.width * thumb.height);
+        let diff = 0;
+        for (let i = 0, j = 0; i < px.length; i += 4, j++) {
+          luma[j] = (px[i] * 77 + px[i + 1] * 150 + px[i + 2] * 29) >> 8;
+          if (lastThumb) diff += Math.abs(luma[j] - lastThumb[j]);
+        }
+        return { changed: !lastThumb || diff / luma.length >= MOTION_THRESHOLD, luma };
+      }
+
+      // True when a frame should be uploaded now (and records it as sent)
+      function shouldSend() {
+        const now = performance.now();
+        if (now - lastSentAt < intervalMs) return false;
+        const { changed, luma } = sceneChanged();
+        if (!changed && now - lastSentAt < HEARTBEAT_MS) return false;
+        lastThumb = luma;
+        lastSentAt = now;
+        return true;
+      }
+
+      function adaptInterval(j, elapsedMs) {
+        responseMs = responseMs === null ? elapsedMs : 0.8 * responseMs + 0.2 * elapsedMs;
+        const hint = (j && j.next_frame_ms) || 400;
+        intervalMs = Math.min(MAX_INTERVAL_MS, Math.max(hint, responseMs));
+      }
+
+      function grabFrame() {
+        // Draw video frame to canvas and encode it as JPEG bytes (no base64/JSON wrapping)
+        ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
+        return new Promise(resolve => canvas.toBlob(resolve, 'image/jpeg', 0.7));
+      }
+
+      // Face crop mode (window.RECOG_FACE_CROPS): where the browser has the FaceDetector
+      // API, only padded crops around the detected faces are uploaded, with the face box
+      // and the crop's position in frame coordinates, and the server skips detection.
+      // Any detector failure switches back to full frames for the rest of the session.
+      let detector = null;
+      if (window.RECOG_FACE_CROPS && 'FaceDetector' in window) {
+        try {
+          detector = new FaceDetector({ fastMode: true, maxDetectedFaces: 10 });
+        } catch (e) {
+          console.warn('FaceDetector unavailable; sending full frames', e);
+        }
+      }
+      const cropCanvas = document.createElement('canvas');
+      const cropCtx = cropCanvas.getContext('2d');
+      const CROP_PAD = 0.5;
+
+      // Returns [{data: Blob, origin: [top, left], box: [top, right, bottom, left]}], or null to send the full frame
+      async function grabCrops() {
+        if (!detector) return null;
+        ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
+        let faces;
+        try {
+          faces = await detector.detect(canvas);
+        } catch (e) {
+          console.warn('FaceDetector failed; sending full frames', e);
+          detector = null;
+          return null;
+        }
+        const crops = [];
+        for (const f of faces) {
+          const b = f.boundingBox;
+          const box = [Math.round(b.top), Math.round(b.right), Math.round(b.bottom), Math.round(b.left)]
+            .map((v, i) => Math.max(0, Math.min(i % 2 ? canvas.width : canvas.height, v)));
+          const dx = Math.round(b.width * CROP_PAD), dy = Math.round(b.height * CROP_PAD);
+          const top = Math.max(0, box[0] - dy), left = Math.max(0, box[3] - dx);
+          const bottom = Math.min(canvas.height, box[2] + dy), right = Math.min(canvas.width, box[1] + dx);
+          if (right - left < 8 || bottom - top < 8) continue;
+          cropCanvas.width = right - left;
+          cropCanvas.height = bottom - top;
+          cropCtx.drawImage(canvas, left, top, cropCanvas.width, cropCanvas.height, 0, 0, cropCanvas.width, cropCanvas.height);
+          const data = await new Promise(resolve => cropCanvas.toBlob(resolve, 'image/jpeg', 0.8));
+          crops.push({ data, origin: [top, left], box });
+        }
+        return crops;
+      }
+
+      // HTTP fallback: one POST per frame, waiting for each response
       async function loop() {
         if (!running) return;
-        
+
         try {
-          // Draw video frame to canvas
-          ctx.drawImage(video, 0, 0, canvas.width, canvas.height);
-          const dataUrl = canvas.toDataURL('image/jpeg', 0.7);
-          
           // Only send one request at a time
-          if (!recognitionInProgress) {
+          if (!recognitionInProgress && shouldSend()) {
             recognitionInProgress = true;
-            
-            const res = await fetch('/api/recognize', {
-              method: 'POST',
-              headers: { 'Content-Type': 'application/json' },
-              body: JSON.stringify({ frame: dataUrl, subject: subject })
-            });
-            
+            const started = performance.now();
+            const url = '/api/recognize?subject=' + encodeURIComponent(subject || '') + '&stream=' + streamId;
+            const crops = await grabCrops();
+            let res;
+            if (crops) {
+              const form = new FormData();
+              crops.forEach((c, i) => form.append('crop', c.data, `crop${i}.jpg`));
+              form.append('crops', JSON.stringify(crops.map(c => ({ origin: c.origin, box: c.box }))));
+              res = await fetch(url, { method: 'POST', body: form });
+            } else {
+              res = await fetch(url, {
+                method: 'POST',
+                headers: { 'Content-Type': 'image/jpeg' },
+                body: await grabFrame()
+              });
+            }
             const j = await res.json();
+            adaptInterval(j, performance.now() - started);
+            await handleResponse(j);
             recognitionInProgress = false;
+          }
+        } catch (e) {
+          console.error('Recognition error:', e);
+          recognitionInProgress = false;
+        }
 
-            // New response format: { ok: true, results: [ { marked: true|false, username, dist, ... }, ... ] }
-            if (j && Array.isArray(j.results)) {
-              // If any face was marked true, stop and return that result
-              const marked = j.results.find(r => r.marked === true);
-              if (marked) {
-                running = false;
-                streamRef.getTracks().forEach(t => t.stop());
-                if (onResult) onResult(marked);
-                return;
-              }
+        if (running) setTimeout(loop, CHECK_MS);
+      }
 
-              // If any face was already marked in DB, show a popup notification
-              const alreadyMarked = j.results.find(r => r.reason === 'already_marked_db');
-              if (alreadyMarked) {
-                try {
-                  // Show a modal that requires the teacher to click OK to proceed to next
-                  await showAlreadyMarkedModal(alreadyMarked.username || alreadyMarked.name, subject);
-                } catch (e) {
-                  console.warn('Already-marked modal failed:', e);
-                }
-                // continue recognition for other faces after OK
-              }
+      // Streaming channel: frames go over one WebSocket and results come back as they
+      // are ready; the server drops frames that went stale while it was busy.
+      let socket = null;
+      let seq = 0;
+      let handling = false;
+      const sentAt = new Map();
 
-              // If any low-confidence matches were returned, log and optionally show UI
-              const low = j.results.find(r => r.reason === 'low_confidence' || r.reason === 'accept_fallback');
-              if (low) {
-                console.warn('Low-confidence match:', low);
-                // show a confirmation modal to the teacher/admin
-                showConfirmation(low.username || low.name, low.dist, subject, async (confirmed) => {
-                  if (confirmed) {
-                    try {
-                      const headers = { 'Content-Type': 'application/json' };
-                      if (window && window.CSRF_TOKEN) headers['X-CSRFToken'] = window.CSRF_TOKEN;
-                      const res = await fetch('/api/confirm_mark', {
-                        method: 'POST',
-                        headers: headers,
-                        body: JSON.stringify({ username: low.username || low.name, subject })
-                      });
-                      const body = await res.json();
-                      if (body && body.marked) {
-                        running = false;
-                        streamRef.getTracks().forEach(t => t.stop());
-                        if (onResult) onResult(body);
-                        return;
-                      } else {
-                        console.warn('Confirm mark failed or already marked', body);
-                      }
-                    } catch (err) {
-                      console.error('Confirm mark request failed', err);
-                    }
-                  } else {
-                    // teacher rejected, continue recognition
-                    console.log('Manual rejection; continuing recognition');
-                  }
-                });
-              }
+      async function streamLoop() {
+        if (!running || !socket) return;
+        try {
+          if (socket.connected && !handling && shouldSend()) {
+            const crops = await grabCrops();
+            sentAt.set(++seq, performance.now());
+            if (crops) {
+              const payload = await Promise.all(crops.map(async c => ({ data: await c.data.arrayBuffer(), origin: c.origin, box: c.box })));
+              socket.emit('frame', { seq, crops: payload });
             } else {
-              // fallback for older format
-              if (j.marked) {
-                running = false;
-                streamRef.getTracks().forEach(t => t.stop());
-                if (onResult) onResult(j);
-                return;
-              }
+              const blob = await grabFrame();
+              socket.emit('frame', { seq, data: await blob.arrayBuffer() });
             }
           }
         } catch (e) {
           console.error('Recognition error:', e);
-          recognitionInProgress = false;
         }
-        
-        // run more frequently for active recognition
-        setTimeout(loop, 400);
+        if (running && socket) setTimeout(streamLoop, CHECK_MS);
+      }
+
+      if (window.io) {
+        socket = io('/recognize', { transports: ['websocket'], reconnectionAttempts: 3 });
+        socket.on('connect', () => socket.emit('start', { subject: subject || '' }));
+        socket.on('result', async (j) => {
+          if (j && sentAt.has(j.seq)) {
+            adaptInterval(j, performance.now() - sentAt.get(j.seq));
+            // frames up to this one are answered or were dropped as stale
+            for (const s of sentAt.keys()) if (s <= j.seq) sentAt.delete(s);
+          }
+          if (!running || handling) return;
+          handling = true;  // no new frames while a modal waits for the teacher
+          try {
+            await handleResponse(j);
+          } finally {
+            handling = false;
+          }
+        });
+        const fallBack = () => {
+          if (!socket) return;
+          console.warn('Streaming channel unavailable; falling back to HTTP');
+          socket.disconnect();
+          socket = null;
+          loop();
+        };
+        // refused by the server (not a teacher/admin session) or no WebSocket after retries
+        socket.on('connect_error', () => { if (socket && !socket.active) fallBack(); });
+        socket.io.on('reconnect_failed', fallBack);
+        streamLoop();
+      } else {
+        loop();
       }
-      
-      loop();
     })
     .catch(error => {
       console.error('Camera permission error:', error);
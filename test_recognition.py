@@ -1,21 +1,19 @@
-"""Quick test: loads encodings.json and evaluates distances for images in `face_data/`.
+"""Quick test: loads the encoding store in `models/` and evaluates distances for images in `face_data/`.
 Prints per-image the best-matching username and distance.
 """
-import os, json
+import os
 import numpy as np
 import face_recognition
+import encoding_store
 
 BASE = os.path.dirname(os.path.abspath(__file__))
 FACE_DIR = os.path.join(BASE, 'face_data')
-ENC_FILE = os.path.join(BASE, 'models', 'encodings.json')
 
-with open(ENC_FILE,'r') as f:
-    data = json.load(f)
+data = encoding_store.load_encodings()
+known_names = data['names']
+known_encs = data['encodings']
 
-known_names = data.get('names', [])
-known_encs = [np.array(e) for e in data.get('encodings', [])]
-
-if not known_encs:
+if not len(known_encs):
     print('No known encodings found. Run train_encodings.py first.')
     raise SystemExit(1)
 
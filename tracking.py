@@ -0,0 +1,110 @@
+"""Per-stream face tracking for /api/recognize.
+
+A teacher's camera sends a frame every few hundred milliseconds and most faces
+in it are the same students sitting still. A FaceTracker remembers the boxes
+and match results of the previous frames:
+
+- faces are associated with tracks by box overlap (IoU), greedily, best first;
+- a track whose last match was accepted is reused: its face is not encoded or
+  matched again until it is due for re-verification (every `reverify_frames`
+  frames or `reverify_secs` seconds, whichever comes first);
+- full-frame detection only runs every `full_detect_every` frames (and whenever
+  there are no tracks); in between, faces are re-detected inside a padded crop
+  around each track, which is far cheaper than scanning the whole frame;
+- tracks not seen for `max_age` seconds are dropped.
+
+The box helpers are plain functions so the recognition workers can use them.
+"""
+import time
+
+
+def iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes."""
+    top, right, bottom, left = max(a[0], b[0]), min(a[1], b[1]), min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if not inter:
+        return 0.0
+    area = lambda r: (r[1] - r[3]) * (r[2] - r[0])
+    return inter / float(area(a) + area(b) - inter)
+
+
+def assign_boxes(locations, boxes, threshold):
+    """Greedy one-to-one IoU assignment; returns, per location, a box index or -1."""
+    pairs = sorted(((iou(loc, box), i, j) for i, loc in enumerate(locations) for j, box in enumerate(boxes)), reverse=True)
+    out = [-1] * len(locations)
+    used = set()
+    for score, i, j in pairs:
+        if score < threshold:
+            break
+        if out[i] == -1 and j not in used:
+            out[i] = j
+            used.add(j)
+    return out
+
+
+def pad_box(box, pad, height, width):
+    """Grow a box by `pad` x its size on every side, clipped to the frame."""
+    top, right, bottom, left = box
+    dh, dw = int((bottom - top) * pad), int((right - left) * pad)
+    return max(0, top - dh), min(width, right + dw), min(height, bottom + dh), max(0, left - dw)
+
+
+class Track:
+    def __init__(self, box, match, now):
+        self.box = box
+        self.match = match
+        self.last_seen = now
+        self.verified_at = now
+        self.frames_since_verify = 0
+
+
+class FaceTracker:
+    def __init__(self, iou_threshold=0.3, max_age=2.0, reverify_frames=10, reverify_secs=5.0, full_detect_every=5):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.reverify_frames = reverify_frames
+        self.reverify_secs = reverify_secs
+        self.full_detect_every = max(1, full_detect_every)
+        self.tracks = []
+        self.frame_no = 0
+        self.last_used = time.time()
+
+    def _reusable(self, t, now):
+        m = t.match
+        return (m is not None and m['decision'].startswith('accept')
+                and t.frames_since_verify < self.reverify_frames
+                and now - t.verified_at < self.reverify_secs)
+
+    def plan(self, now=None):
+        """Prepare the next frame: returns ([(box, reuse), ...], full_detect)."""
+        now = now or time.time()
+        self.last_used = now
+        self.tracks = [t for t in self.tracks if now - t.last_seen <= self.max_age]
+        full = not self.tracks or self.frame_no % self.full_detect_every == 0
+        self.frame_no += 1
+        return [(t.box, self._reusable(t, now)) for t in self.tracks], full
+
+    def cached_match(self, track_index):
+        return self.tracks[track_index].match
+
+    def update(self, locations, assigned, encoded, matches, now=None):
+        """Record one processed frame.
+
+        `assigned[i]` is the track index face i was associated with (-1 for a new
+        face), `encoded[i]` whether it was freshly encoded and matched, and
+        `matches[i]` its match dict (fresh or cached).
+        """
+        now = now or time.time()
+        for loc, j, enc, match in zip(locations, assigned, encoded, matches):
+            if j < 0:
+                self.tracks.append(Track(loc, match, now))
+                continue
+            t = self.tracks[j]
+            t.box = loc
+            t.last_seen = now
+            if enc:
+                t.match = match
+                t.verified_at = now
+                t.frames_since_verify = 0
+            else:
+                t.frames_since_verify += 1
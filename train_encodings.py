@@ -1,59 +1,76 @@
 #!/usr/bin/env python3
-"""Rebuild face encodings from images in `face_data/` and save to `models/encodings.json`.
+"""Update face encodings from images in `face_data/` and save them to the binary
+encoding store in `models/` (see `encoding_store.py`).
+
+Only new or changed images are encoded; encodings of removed images are dropped
+(see `trainer.py`). Pass `--full` to ignore the manifest and re-encode everything.
+Encoding runs on a process pool with one worker per core; `--workers N` changes
+that (`--workers 1` encodes in-process and prints every file), and `--fork`
+forks them from this process instead of a forkserver.
 
 Usage:
-    python train_encodings.py
+    python train_encodings.py [--full] [--workers N] [--fork]
 
-This script mirrors the app's `build_encodings_from_images` logic but runs standalone.
+This script runs the same incremental update as the app's `build_encodings_from_images`.
 """
 import os
-import json
 import sys
-import numpy as np
-import face_recognition
+import argparse
+import trainer
 
 BASE = os.path.dirname(os.path.abspath(__file__))
 FACE_DIR = os.path.join(BASE, 'face_data')
 MODEL_DIR = os.path.join(BASE, 'models')
-ENC_FILE = os.path.join(MODEL_DIR, 'encodings.json')
-
-os.makedirs(MODEL_DIR, exist_ok=True)
-
-all_names = []
-all_encs = []
-
-count_skipped = 0
-for username in sorted(os.listdir(FACE_DIR)):
-    user_folder = os.path.join(FACE_DIR, username)
-    if not os.path.isdir(user_folder):
-        continue
-    for fname in sorted(os.listdir(user_folder)):
-        if not fname.lower().endswith(('.jpg', '.jpeg', '.png')):
-            continue
-        path = os.path.join(user_folder, fname)
+
+
+def encode_verbose(paths):
+    out = []
+    for path in paths:
+        rel = os.path.relpath(path, FACE_DIR)
         try:
-            img = face_recognition.load_image_file(path)
-            encs = face_recognition.face_encodings(img)
-            if not encs:
-                print(f"No face found in {path}; skipping")
-                count_skipped += 1
-                continue
-            # take first face encoding found in image
-            all_encs.append(encs[0].tolist())
-            all_names.append(username)
-            print(f"Encoded: {username}/{fname}")
+            enc = trainer.encode_image(path)
+            print(f"Encoded: {rel}" if enc is not None else f"No face found in {path}; skipping")
+            out.append(enc)
         except Exception as e:
             print(f"Error processing {path}: {e}")
-            count_skipped += 1
+            out.append(e)
+    return out
+
+
+def encode_parallel(paths):
+    def progress(done, total, elapsed):
+        rate = done / elapsed if elapsed else 0.0
+        print(f"  {done}/{total} images  {rate:.1f} img/s", end='\r' if done < total else '\n', flush=True)
+
+    results = trainer.parallel_encode(paths, workers=args.workers, progress=progress, min_parallel=1,
+                                      start_method='fork' if args.fork else None)
+    for path, r in zip(paths, results):
+        if isinstance(r, Exception):
+            print(f"Error processing {path}: {r}")
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Update the face encoding store from face_data/.')
+    parser.add_argument('--full', action='store_true', help='re-encode every image')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='encoder processes (default: all cores)')
+    parser.add_argument('--fork', action='store_true', help='fork the workers instead of starting them from a forkserver (faster start-up)')
+    args = parser.parse_args()
+
+    os.makedirs(MODEL_DIR, exist_ok=True)
+    if args.full:
+        manifest = os.path.join(MODEL_DIR, trainer.MANIFEST_FILE)
+        if os.path.exists(manifest):
+            os.remove(manifest)
 
-if not all_encs:
-    print("No encodings generated. Check that `face_data/` contains images.")
-    sys.exit(1)
+    stats = trainer.update_encodings(FACE_DIR, MODEL_DIR, encode=encode_verbose if args.workers <= 1 else encode_parallel)
 
-data = {"names": all_names, "encodings": all_encs}
-with open(ENC_FILE, 'w') as f:
-    json.dump(data, f)
+    if not stats['total']:
+        print("No encodings generated. Check that `face_data/` contains images.")
+        sys.exit(1)
 
-print(f"Saved {len(all_encs)} encodings for {len(set(all_names))} users to {ENC_FILE}")
-if count_skipped:
-    print(f"Skipped {count_skipped} images (no face or errors)")
+    print(f"Saved {stats['total']} encodings to {MODEL_DIR} "
+          f"(added {stats['added']}, updated {stats['updated']}, removed {stats['removed']}, reused {stats['reused']})")
+    skipped = stats['no_face'] + stats['errors']
+    if skipped:
+        print(f"Skipped {skipped} images (no face or errors)")
@@ -0,0 +1,255 @@
+"""Incremental encoding builder for `face_data/`.
+
+Keeps a manifest next to the encoding store (`models/encodings.manifest.json`)
+that maps every image (`username/file.jpg`) to its mtime, size, sha1 and the
+row of its encoding in the store (or null when no face was found or the file
+could not be read). On each
+update only new or changed images are run through the face detector and
+encoder; encodings of deleted images or users are dropped, and everything else
+is copied from the current store.
+
+The manifest records which store generation it describes. If the two ever
+disagree (e.g. a crash between writing them) the next update re-encodes
+everything, so the manifest can never point at the wrong rows.
+
+`parallel_encode` spreads encoding over a process pool (dlib's HOG detector
+and ResNet encoder are CPU-bound and single-threaded) and can be passed as the
+`encode` argument of `update_encodings`.
+"""
+import os, json, time, hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import face_recognition
+import encoding_store
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png')
+MANIFEST_FILE = 'encodings.manifest.json'
+
+
+def scan_images(face_dir):
+    """Sorted list of (username, relpath, abspath) for every image in face_dir."""
+    out = []
+    if not os.path.isdir(face_dir):
+        return out
+    for username in sorted(os.listdir(face_dir)):
+        folder = os.path.join(face_dir, username)
+        if not os.path.isdir(folder):
+            continue
+        for fname in sorted(os.listdir(folder)):
+            if fname.lower().endswith(IMAGE_EXTS):
+                out.append((username, f'{username}/{fname}', os.path.join(folder, fname)))
+    return out
+
+
+def file_sha1(path):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def encode_image(path):
+    """Encoding of the first face in an image, or None if no face was found."""
+    img = face_recognition.load_image_file(path)
+    d = face_recognition.face_encodings(img)
+    return d[0] if d else None
+
+
+def _store_generation(model_dir):
+    meta_path = os.path.join(model_dir, encoding_store.META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path, 'r') as f:
+        return json.load(f).get('matrix')
+
+
+def load_manifest(model_dir):
+    """Manifest entries for the current store generation ({} if missing or stale)."""
+    path = os.path.join(model_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if data.get('generation') != _store_generation(model_dir):
+        return {}
+    return data.get('entries', {})
+
+
+def save_manifest(model_dir, entries):
+    path = os.path.join(model_dir, MANIFEST_FILE)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'version': 1, 'generation': _store_generation(model_dir), 'entries': entries}, f)
+    os.replace(tmp, path)
+
+
+def update_encodings(face_dir, model_dir, encode=None, logger=None):
+    """Bring the encoding store in line with face_dir, encoding only what changed.
+
+    `encode(paths)` may be supplied to encode a batch of images at once; it must
+    return one result per path, in order: an encoding, None (no face), or the
+    Exception that made the image unreadable. Returns a stats dict with
+    added / updated / removed / reused / no_face / errors / total / changed.
+    """
+    if encode is None:
+        encode = lambda paths: [_safe_encode(p, logger) for p in paths]
+    old_entries = load_manifest(model_dir)
+    store = encoding_store.load_encodings(model_dir) if old_entries else None
+    images = scan_images(face_dir)
+
+    stats = {'added': 0, 'updated': 0, 'removed': 0, 'reused': 0, 'no_face': 0, 'errors': 0}
+    plan = []          # (username, relpath, entry, source) where source is ('old', row) or ('new', i)
+    pending = []       # abspaths to encode
+    for username, rel, path in images:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entry = {'mtime': st.st_mtime, 'size': st.st_size}
+        old = old_entries.get(rel)
+        if old and old.get('mtime') == st.st_mtime and old.get('size') == st.st_size:
+            entry['sha1'] = old.get('sha1')
+            if 'error' in old:
+                entry['error'] = old['error']
+            plan.append((username, rel, entry, ('old', old.get('row'))))
+            stats['reused'] += 1
+            continue
+        entry['sha1'] = file_sha1(path)
+        if old and old.get('sha1') == entry['sha1']:
+            # touched but identical content
+            if 'error' in old:
+                entry['error'] = old['error']
+            plan.append((username, rel, entry, ('old', old.get('row'))))
+            stats['reused'] += 1
+            continue
+        stats['updated' if old else 'added'] += 1
+        plan.append((username, rel, entry, ('new', len(pending))))
+        pending.append(path)
+    current = {rel for _, rel, _ in images}
+    stats['removed'] = sum(1 for rel in old_entries if rel not in current)
+
+    fresh = encode(pending) if pending else []
+
+    names, encs, entries = [], [], {}
+    for username, rel, entry, (kind, ref) in plan:
+        if kind == 'old':
+            vec = store['encodings'][ref] if ref is not None else None
+        else:
+            vec = fresh[ref]
+            if isinstance(vec, Exception):
+                # remembered so an unreadable file is only retried once it changes
+                entry['error'] = str(vec)
+                vec = None
+        if vec is None:
+            stats['errors' if 'error' in entry else 'no_face'] += 1
+            entry['row'] = None
+        else:
+            entry['row'] = len(encs)
+            encs.append(np.asarray(vec, dtype=np.float32))
+            names.append(username)
+        entries[rel] = entry
+
+    stats['total'] = len(encs)
+    stats['changed'] = bool(pending or stats['removed'] or not old_entries)
+    if stats['changed']:
+        encoding_store.save_encodings(names, encs, model_dir)
+        save_manifest(model_dir, entries)
+    elif stats['reused'] and entries != old_entries:
+        # only mtimes moved; refresh them so the next scan is hash-free again
+        save_manifest(model_dir, entries)
+    return stats
+
+
+def _safe_encode(path, logger=None):
+    try:
+        return encode_image(path)
+    except Exception as e:
+        if logger:
+            logger.warning('skip %s: %s', path, e)
+        return e
+
+
+def _worker_init():
+    # run the encoder once so the first real chunk is not slow; best effort only,
+    # a failure here must not break the pool
+    try:
+        face_recognition.face_encodings(np.zeros((150, 150, 3), dtype=np.uint8), [(0, 150, 150, 0)])
+    except Exception:
+        pass
+
+
+def _encode_chunk(paths):
+    out = []
+    for p in paths:
+        try:
+            out.append(encode_image(p))
+        except Exception as e:
+            # plain RuntimeError so it always pickles back to the parent
+            out.append(RuntimeError(f'{type(e).__name__}: {e}'))
+    return out
+
+
+def parallel_encode(paths, workers=None, chunk_size=8, progress=None, logger=None, min_parallel=32,
+                    start_method=None):
+    """Encode `paths` on a process pool; results come back in input order.
+
+    At most 2 chunks per worker are in flight, so memory stays bounded however
+    many images there are. `progress(done, total, elapsed_s)` is called after
+    every chunk. Small batches (< min_parallel) or workers <= 1 run in-process,
+    since starting and warming up workers costs more than it saves.
+
+    Workers start with `start_method`, by default forkserver (spawn where that
+    is unavailable). 'fork' is only safe from a single-threaded caller such as
+    train_encodings.py: the app calls this from a scheduler thread, and a child
+    forked there can inherit a lock another thread was holding.
+    """
+    workers = workers or os.cpu_count() or 1
+    total = len(paths)
+    t0 = time.perf_counter()
+    if workers <= 1 or total < min_parallel:
+        results = []
+        for p in paths:
+            results.append(_safe_encode(p, logger))
+            if progress:
+                progress(len(results), total, time.perf_counter() - t0)
+        _report(logger, total, t0, 1)
+        return results
+
+    # forkserver and spawn re-import the caller's __main__ (as __mp_main__), so
+    # entry points must be import-safe (see train_encodings.py, app.py)
+    if start_method is None:
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    ctx = multiprocessing.get_context(start_method)
+    chunks = [paths[i:i + chunk_size] for i in range(0, total, chunk_size)]
+    results = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_worker_init) as pool:
+        inflight = deque()
+        for chunk in chunks:
+            inflight.append(pool.submit(_encode_chunk, chunk))
+            if len(inflight) >= workers * 2:
+                results.extend(inflight.popleft().result())
+                if progress:
+                    progress(len(results), total, time.perf_counter() - t0)
+        while inflight:
+            results.extend(inflight.popleft().result())
+            if progress:
+                progress(len(results), total, time.perf_counter() - t0)
+    if logger:
+        for p, r in zip(paths, results):
+            if isinstance(r, Exception):
+                logger.warning('skip %s: %s', p, r)
+    _report(logger, total, t0, workers)
+    return results
+
+
+def _report(logger, total, t0, workers):
+    elapsed = time.perf_counter() - t0
+    if logger and total:
+        logger.info('encoded %d images in %.1fs (%.1f img/s, %d worker%s)',
+                    total, elapsed, total / elapsed if elapsed else 0.0, workers, '' if workers == 1 else 's')